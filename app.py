@@ -1,20 +1,50 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, session, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, send_file, session, jsonify, g, Response,
+                   stream_with_context)
 import os
+import time
 import tempfile
-import shutil
 import uuid
+import hashlib
+import logging
 from datetime import datetime
-from modules.downloader import download_xml_files
-from modules.parser import parse_xml_data
-from modules.excel_generator import generate_excel_files
+from urllib.parse import quote
+from modules import metrics, janitor
+from modules.jobs import submit_job, get_job, flight_key
+from modules.pipeline import STAGES, ReportError, run_report, load_report_matrix
+from modules.ratings_export import EXPORT_FORMATS, stream_ratings
+from modules.batch import BATCH_STAGES, MAX_BATCH_ITEMS, normalize_item, run_batch
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'default_secret_key')
 
 # Создаем постоянную директорию для хранения файлов
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp_files')
+UPLOAD_FOLDER = janitor.TEMP_FILES_DIR
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Старые каталоги сессий удаляются в фоне, а не при обработке запросов
+janitor.start()
+
+# Количество одновременных загрузок месяцев с сайта 1С
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+
+# Количество процессов для разбора XML (0 - последовательный разбор)
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 0))
+
+# Загружать и разбирать только новые или изменившиеся месяцы
+INCREMENTAL_REFRESH = os.environ.get('INCREMENTAL_REFRESH', '1') == '1'
+
+# Где создаются книги: 'disk' - файлы с кэшем отчетов, 'memory' - в памяти с отдачей без временных файлов
+REPORT_OUTPUT = os.environ.get('REPORT_OUTPUT', 'disk')
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Профилирование отчетов: 'always' - каждый отчет, 'header' - по заголовку X-Profile-Report: 1, пусто - выключено
+PROFILE_REPORTS = os.environ.get('PROFILE_REPORTS', '')
+
 # Функция для создания уникальной директории пользователя
 def get_user_temp_dir():
     # Если у пользователя еще нет ID сессии, создаем новый
@@ -24,6 +54,7 @@ def get_user_temp_dir():
     # Создаем директорию для пользователя
     user_dir = os.path.join(UPLOAD_FOLDER, session['user_temp_dir'])
     os.makedirs(user_dir, exist_ok=True)
+    janitor.touch(session['user_temp_dir'])
     return user_dir
 
 @app.route('/', methods=['GET'])
@@ -40,8 +71,14 @@ def generate_report():
         
         # Получаем параметры из формы
         year = request.form.get('year')
+        year_to = request.form.get('year_to') or year
         period_type = request.form.get('period_type')
         
+        # Отчет за несколько лет строится по возрастанию лет
+        if int(year_to) < int(year):
+            return render_template('error.html', 
+                                message="Конечный год не может быть меньше начального.")
+        
         # Получаем учетные данные
         username = request.form.get('username')
         password = request.form.get('password')
@@ -60,55 +97,194 @@ def generate_report():
         
         # Определяем тип отчета
         report_type = request.form.get('report_type')
+        report_types = [t for t in ('free', 'paid') if report_type in (t, 'both')]
+        combined = request.form.get('combine_sheets') == 'true'
         
-        # Получаем XML-файлы
-        if use_local_files:
-            xml_files = create_test_xml_files(year, months, temp_dir)
-        else:
-            xml_files = download_xml_files(year, months, temp_dir, username, password)
-        
-        # Проверяем, загрузились ли файлы
-        if not xml_files:
-            return render_template('error.html', 
-                                message="Не удалось загрузить XML файлы. Проверьте правильность учетных данных и подключение к интернету.")
-        
-        # Парсим данные
-        parsed_data = parse_xml_data(xml_files)
-        
-        # Проверяем, что данные успешно извлечены
-        if not parsed_data['partners']:
-            return render_template('error.html', 
-                                message="Не удалось извлечь данные партнеров из XML файлов. Возможно, формат файлов изменился.")
-        
-        # Генерируем Excel-файлы
-        excel_files = []
+        # Отбор партнеров выполняется до построения таблиц отчета
         try:
-            if report_type in ['free', 'both']:
-                free_excel = generate_excel_files(parsed_data, 'free', year, months, temp_dir)
-                excel_files.append({'name': 'Льготные 1C:ИТС', 'path': free_excel})
-            
-            if report_type in ['paid', 'both']:
-                paid_excel = generate_excel_files(parsed_data, 'paid', year, months, temp_dir)
-                excel_files.append({'name': 'Платные 1C:ИТС', 'path': paid_excel})
-        except Exception as e:
+            filters = get_report_filters(request.form)
+        except ValueError:
             return render_template('error.html', 
-                                message=f"Произошла ошибка при создании Excel-файлов: {str(e)}")
+                                message="Количество партнеров должно быть положительным целым числом, а минимальное изменение - неотрицательным целым числом.")
         
-        # Проверяем, что файлы существуют
-        for file_info in excel_files:
-            if not os.path.exists(file_info['path']):
-                return render_template('error.html', 
-                                    message=f"Не удалось создать файл отчета: {file_info['name']}")
+        params = {
+            'year': year,
+            'year_to': year_to,
+            'months': months,
+            'report_types': report_types,
+            'combined': combined,
+            'use_local_files': use_local_files,
+            'username': username,
+            'password': password,
+            **filters
+        }
         
-        # Сохраняем пути к файлам в сессии
-        session['excel_files'] = excel_files
+        # Профиль снимается для всех отчетов или только по заголовку запроса
+        profile = PROFILE_REPORTS == 'always' or (
+            PROFILE_REPORTS == 'header' and request.headers.get('X-Profile-Report') == '1')
         
-        return render_template('result.html', excel_files=excel_files)
+        # Отчет формируется в фоне, страница результата опрашивает состояние задачи
+        # Одинаковые одновременные запросы ждут одного формирования отчета
+        dedup_key = request_flight_key(
+            'report', params, year=int(year), year_to=int(year_to), months=sorted(months),
+            cities=sorted(city.casefold() for city in filters['cities'] or []))
+        job_id = submit_job(session['user_temp_dir'], STAGES, build_report, params, temp_dir, profile=profile,
+                            dedup_key=dedup_key)
+        session['excel_files'] = []
+        
+        return render_template('result.html', job_id=job_id, excel_files=[])
     
     except Exception as e:
+        logger.exception("Ошибка при постановке отчета в очередь")
         return render_template('error.html', 
                             message=f"Произошла непредвиденная ошибка: {str(e)}")
 
+def build_report(params, temp_dir, stage, profile=False):
+    """Формирование отчета в фоновой задаче"""
+    try:
+        with metrics.profiled('report', enabled=profile):
+            return run_report(params, temp_dir, stage=stage,
+                              download_workers=DOWNLOAD_WORKERS, parse_workers=PARSE_WORKERS,
+                              incremental=INCREMENTAL_REFRESH, output=REPORT_OUTPUT)
+    except ReportError:
+        raise
+    except Exception as e:
+        logger.exception("Непредвиденная ошибка при формировании отчета")
+        raise ReportError(f"Произошла непредвиденная ошибка: {str(e)}")
+
+@app.route('/api/ratings', methods=['POST'])
+def ratings_api():
+    """Рейтинг партнеров по месяцам с разницами в формате NDJSON или CSV без создания Excel-файлов"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Параметры запроса должны быть JSON-объектом'}), 400
+    temp_dir = get_user_temp_dir()
+    
+    export_format = data.get('format') or ('csv' if request.accept_mimetypes.best == 'text/csv' else 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Формат должен быть ndjson или csv'}), 400
+    
+    try:
+        item = normalize_item(data)
+        year_to = int(data.get('year_to') or item['year'])
+        filters = get_report_filters(data)
+    except ReportError as e:
+        return jsonify({'error': str(e)}), 400
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Неверный конечный год, количество партнеров или минимальное изменение'}), 400
+    if year_to < item['year']:
+        return jsonify({'error': 'Конечный год не может быть меньше начального.'}), 400
+    
+    use_local_files = bool(data.get('use_local_files'))
+    if not use_local_files and (not data.get('username') or not data.get('password')):
+        return jsonify({'error': 'Для получения данных необходимо указать логин и пароль от сайта 1С.'}), 400
+    
+    params = {
+        'region': item['region'],
+        'city': item['city'],
+        'year': item['year'],
+        'year_to': year_to,
+        'months': list(item['months']),
+        'use_local_files': use_local_files,
+        'username': data.get('username'),
+        'password': data.get('password'),
+        'cities': filters['cities']
+    }
+    
+    # Данные разбираются до начала ответа, чтобы ошибки вернулись обычным ответом
+    try:
+        matrix = load_report_matrix(params, temp_dir, download_workers=DOWNLOAD_WORKERS,
+                                    parse_workers=PARSE_WORKERS, incremental=INCREMENTAL_REFRESH)
+    except ReportError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Непредвиденная ошибка при выгрузке рейтинга")
+        return jsonify({'error': f'Произошла непредвиденная ошибка: {str(e)}'}), 500
+    
+    # Строки отдаются блоками по мере формирования (chunked transfer encoding)
+    chunks = stream_ratings(matrix, item['report_types'], export_format,
+                            top_n=filters['top_n'], min_change=filters['min_change'])
+    return Response(stream_with_context(chunks), content_type=EXPORT_FORMATS[export_format])
+
+@app.route('/api/batch', methods=['POST'])
+def batch_report():
+    """Пакет отчетов по списку {region, city, year, months, report_type} в одном ZIP-архиве"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Параметры запроса должны быть JSON-объектом'}), 400
+    temp_dir = get_user_temp_dir()
+    
+    try:
+        items = [normalize_item(item) for item in data.get('items') or []]
+    except ReportError as e:
+        return jsonify({'error': str(e)}), 400
+    if not items:
+        return jsonify({'error': 'Не указаны отчеты пакета (items)'}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'В пакете не может быть больше {MAX_BATCH_ITEMS} отчетов'}), 400
+    
+    use_local_files = bool(data.get('use_local_files'))
+    if not use_local_files and (not data.get('username') or not data.get('password')):
+        return jsonify({'error': 'Для получения данных необходимо указать логин и пароль от сайта 1С.'}), 400
+    
+    params = {
+        'use_local_files': use_local_files,
+        'combined': bool(data.get('combined')),
+        'username': data.get('username'),
+        'password': data.get('password')
+    }
+    job_id = submit_job(session['user_temp_dir'], BATCH_STAGES, build_batch, items, params, temp_dir,
+                        dedup_key=request_flight_key('batch', params, items=items))
+    return jsonify({'id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+
+def build_batch(items, params, temp_dir, stage):
+    """Формирование пакета отчетов в фоновой задаче"""
+    try:
+        return run_batch(items, params, temp_dir, stage=stage,
+                         download_workers=DOWNLOAD_WORKERS, parse_workers=PARSE_WORKERS,
+                         incremental=INCREMENTAL_REFRESH)
+    except ReportError:
+        raise
+    except Exception as e:
+        logger.exception("Непредвиденная ошибка при формировании пакета отчетов")
+        raise ReportError(f"Произошла непредвиденная ошибка: {str(e)}")
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id, owner=session.get('user_temp_dir'))
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    
+    response = {
+        'id': job['id'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'stages': job['stages'],
+        'error': job['error']
+    }
+    
+    if job['status'] == 'done':
+        # Сохраняем пути к файлам в сессии, для книг в памяти - ссылку на задачу
+        excel_files = job['result']
+        session['excel_files'] = [
+            {'name': file_info['name'], 'path': file_info['path']} if 'path' in file_info
+            else {'name': file_info['name'], 'job_id': job['id'], 'index': idx}
+            for idx, file_info in enumerate(excel_files)
+        ]
+        response['files'] = [
+            {'name': file_info['name'], 'url': url_for('download_file', file_index=idx)}
+            for idx, file_info in enumerate(excel_files)
+        ]
+    
+    return jsonify(response)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # JSON по запросу, по умолчанию - текстовый формат Prometheus
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
 def get_months_from_period(period_type, custom_months=None):
     """Получение списка месяцев на основе выбранного периода"""
     if period_type == 'year':
@@ -125,12 +301,52 @@ def get_months_from_period(period_type, custom_months=None):
         return [int(month) for month in custom_months]
     return []
 
+def request_flight_key(kind, params, **normalized):
+    """Ключ объединения одинаковых запросов по нормализованным параметрам"""
+    # Учетные данные входят в ключ только хэшем: запросы с другим логином или паролем не объединяются,
+    # поэтому неверный пароль одного запроса не влияет на остальные
+    credentials = hashlib.sha256(f"{params.get('username')}\0{params.get('password')}".encode('utf-8')).hexdigest()
+    data = {key: value for key, value in params.items() if key not in ('username', 'password')}
+    data.update(normalized, credentials=credentials)
+    return flight_key(kind, data)
+
+def get_report_filters(form):
+    """Отбор партнеров: первые top_n по последнему месяцу, города через запятую и минимальное изменение"""
+    top_n = str(form.get('top_n') or '').strip()
+    min_change = str(form.get('min_change') or '').strip()
+    # Города приходят строкой через запятую из формы или списком из JSON
+    cities = form.get('cities') or ''
+    cities = cities.split(',') if isinstance(cities, str) else cities
+    cities = [str(city).strip() for city in cities if str(city).strip()]
+    filters = {
+        'top_n': int(top_n) if top_n else None,
+        'cities': cities or None,
+        'min_change': int(min_change) if min_change else None
+    }
+    if (filters['top_n'] is not None and filters['top_n'] < 1) or (filters['min_change'] or 0) < 0:
+        raise ValueError("top_n и min_change не могут быть отрицательными")
+    return filters
+
 @app.route('/download/<int:file_index>')
 def download_file(file_index):
     excel_files = session.get('excel_files', [])
     
     if 0 <= file_index < len(excel_files):
         file_info = excel_files[file_index]
+        file_name = f"{file_info['name']}.xlsx"
+        
+        # Книга в памяти отдается частями из результата задачи
+        if 'job_id' in file_info:
+            job = get_job(file_info['job_id'], owner=session.get('user_temp_dir'))
+            if job is None or job['status'] != 'done':
+                return render_template('error.html',
+                                    message="Файл не найден. Возможно, он был удален или истек срок его хранения."), 404
+            workbook = job['result'][file_info['index']]['workbook']
+            return Response(workbook.iter_chunks(), mimetype=XLSX_MIMETYPE, headers={
+                'Content-Disposition': f"attachment; filename*=UTF-8''{quote(file_name)}",
+                'Content-Length': str(workbook.size)
+            })
+        
         file_path = file_info['path']
         
         # Проверяем существование файла
@@ -138,113 +354,26 @@ def download_file(file_index):
             return render_template('error.html',
                                 message="Файл не найден. Возможно, он был удален или истек срок его хранения."), 404
         
-        file_name = f"{file_info['name']}.xlsx"
+        # Пакет отчетов отдается ZIP-архивом
+        file_name = f"{file_info['name']}{os.path.splitext(file_path)[1] or '.xlsx'}"
         return send_file(file_path, 
                         as_attachment=True, 
                         download_name=file_name)
     
     return redirect(url_for('index'))
 
-def create_test_xml_files(year, months, temp_dir):
-    """Создает тестовые XML файлы для указанного года и месяцев"""
-    sample_xml_content = """<?xml version="1.0" encoding="UTF-8"?>
-<partners>
-	<partner>
-		<place>1</place>
-		<region>Кыргызстан</region>
-		<city>Бишкек</city>
-		<name>1С-Като Экономикс</name>
-		<all_subs>2343 (+3.4%)</all_subs>
-		<all_amount>2343</all_amount>
-		<all_change>3.4</all_change>
-		<free_subs>18 (+5.88%)</free_subs>
-		<free_amount>18</free_amount>
-		<free_change>5.88</free_change>
-		<paid_subs>2325 (+3.38%)</paid_subs>
-		<paid_amount>2325</paid_amount>
-		<paid_change>3.38</paid_change>
-		<perf_subs>1</perf_subs>
-		<perf_amount>1</perf_amount>
-		<perf_change>0</perf_change>
-		<movement></movement>
-		<duo_subs>0</duo_subs>
-		<duo_amount>0</duo_amount>
-		<otchetnost>0</otchetnost>
-		<paid_drop>9.44%</paid_drop>
-		<free_drop>69.91%</free_drop>
-		<share>64.56%</share>
-		<share_change>-1.62%</share_change>
-		<status></status>
-		<in_order>Да</in_order>
-		<perf_ratio>Да</perf_ratio>
-	</partner>
-	<partner>
-		<place>2</place>
-		<region>Кыргызстан</region>
-		<city>Бишкек</city>
-		<name>ЛИСТ Кей Джи</name>
-		<all_subs>212 (+7.07%)</all_subs>
-		<all_amount>212</all_amount>
-		<all_change>7.07</all_change>
-		<free_subs>24 (-4%)</free_subs>
-		<free_amount>24</free_amount>
-		<free_change>-4</free_change>
-		<paid_subs>188 (+8.67%)</paid_subs>
-		<paid_amount>188</paid_amount>
-		<paid_change>8.67</paid_change>
-		<perf_subs>1</perf_subs>
-		<perf_amount>1</perf_amount>
-		<perf_change>0</perf_change>
-		<movement></movement>
-		<duo_subs>0</duo_subs>
-		<duo_amount>0</duo_amount>
-		<otchetnost>0</otchetnost>
-		<paid_drop></paid_drop>
-		<free_drop>15.85%</free_drop>
-		<share>5.84%</share>
-		<share_change>1.92%</share_change>
-		<status></status>
-		<in_order>Нет</in_order>
-		<perf_ratio>Да</perf_ratio>
-	</partner>
-</partners>"""
-    
-    # Создаем файлы для каждого месяца
-    test_files = []
-    for month in months:
-        filename = f"export_{year}_{month:02d}.xml"
-        file_path = os.path.join(temp_dir, filename)
-        
-        # Записываем содержимое в файл
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(sample_xml_content)
-        
-        # Добавляем информацию о файле
-        test_files.append({
-            'path': file_path,
-            'year': int(year),
-            'month': month
-        })
-    
-    return test_files
-
-# Очистка старых временных файлов (запускается периодически)
+# Учет длительности обработки запросов
 @app.before_request
-def cleanup_old_temp_dirs():
-    try:
-        # Очищаем только старые директории (не текущую сессию)
-        if 'user_temp_dir' in session and os.path.exists(UPLOAD_FOLDER):
-            current_user_dir = session['user_temp_dir']
-            for dir_name in os.listdir(UPLOAD_FOLDER):
-                dir_path = os.path.join(UPLOAD_FOLDER, dir_name)
-                if dir_name != current_user_dir and os.path.isdir(dir_path):
-                    # Проверяем, что директория старше определенного времени
-                    dir_age = datetime.now().timestamp() - os.path.getmtime(dir_path)
-                    if dir_age > 86400:  # 24 часа в секундах
-                        shutil.rmtree(dir_path, ignore_errors=True)
-    except Exception:
-        # Игнорируем ошибки при очистке
-        pass
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe('http_request', time.perf_counter() - started,
+                        endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
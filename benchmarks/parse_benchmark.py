@@ -0,0 +1,44 @@
+"""Сравнение последовательного и параллельного разбора XML-файлов
+
+Запуск: python -m benchmarks.parse_benchmark --months 36 --partners 3000 --workers 4
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate_exports
+from modules.parser import parse_xml_data
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--months', type=int, default=36)
+    arg_parser.add_argument('--partners', type=int, default=3000)
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    arg_parser.add_argument('--seed', type=int, default=1)
+    args = arg_parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        periods = [(2024 + idx // 12, idx % 12 + 1) for idx in range(args.months)]
+        xml_files = generate_exports(temp_dir, periods, args.partners, args.seed)
+        
+        started = time.perf_counter()
+        serial = parse_xml_data(list(xml_files))
+        serial_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        parallel = parse_xml_data(list(xml_files), workers=args.workers)
+        parallel_time = time.perf_counter() - started
+    
+    assert serial == parallel, "Параллельный разбор дал другой результат"
+    
+    print(f"Месяцев: {args.months}, партнеров: {args.partners}, процессов: {args.workers}")
+    print(f"Последовательно: {serial_time:.2f} с")
+    print(f"Параллельно:     {parallel_time:.2f} с")
+    print(f"Ускорение:       {serial_time / parallel_time:.2f}x")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
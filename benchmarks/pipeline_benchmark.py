@@ -0,0 +1,257 @@
+"""Сквозной бенчмарк этапов формирования отчета на синтетических данных
+
+Запуск: python -m benchmarks.pipeline_benchmark --years 2024 2025 --partners 5000 --output results.json
+Сравнение с прошлым запуском: --compare previous.json
+"""
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import generate_exports
+from modules import downloader, xml_cache
+from modules.parser import parse_month_records
+from modules.ratings_matrix import RatingMatrix
+from modules.excel_generator import generate_reports
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Ответы тестового сервера выгрузки: файл месяца по параметру date"""
+    
+    def do_GET(self):
+        date_param = parse_qs(urlparse(self.path).query).get('date', [''])[0]
+        path = self.server.files.get(date_param)
+        if path is None:
+            self.send_error(404)
+            return
+        
+        etag = f'"{os.path.getmtime(path)}-{os.path.getsize(path)}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        
+        with open(path, 'rb') as f:
+            content = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(xml_files):
+    """Локальный сервер, отдающий выгрузки вместо сайта 1С"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    server.files = {f"{file_info['month']:02d}.{file_info['year']}": file_info['path'] for file_info in xml_files}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Период опроса памяти процесса во время этапа в секундах
+RSS_SAMPLE_INTERVAL = 0.01
+
+def _process_peak_rss_mb():
+    """Пиковый объем памяти процесса с начала работы (накопительный, не по этапу)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS - в байтах
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _current_rss_mb():
+    """Текущий объем памяти процесса (Linux) или None, если его нельзя узнать"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+class RssSampler:
+    """Пик памяти процесса за время этапа: текущий объем опрашивается в отдельном потоке"""
+    
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_mb = self.peak_mb = _current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+    
+    def _sample(self):
+        current = _current_rss_mb()
+        if current is not None:
+            self.peak_mb = max(self.peak_mb, current)
+    
+    def __enter__(self):
+        if self.start_mb is not None:
+            self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        if self.start_mb is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+def measure(name, func, trace_allocations=False):
+    """Запуск этапа с замером времени, пика памяти за этап и выделений"""
+    if trace_allocations:
+        tracemalloc.start()
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+    
+    stats = {'elapsed': round(elapsed, 4)}
+    if sampler.start_mb is not None:
+        # Пик за этап и прирост относительно начала этапа (память дочерних процессов не учитывается)
+        stats['peak_rss_mb'] = round(sampler.peak_mb, 1)
+        stats['rss_growth_mb'] = round(sampler.peak_mb - sampler.start_mb, 1)
+    else:
+        # Без /proc доступен только накопительный пик процесса
+        stats['process_peak_rss_mb'] = _process_peak_rss_mb()
+    if trace_allocations:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats['alloc_peak_mb'] = round(peak / 1024 / 1024, 1)
+    print(f"{name:<10} {elapsed:8.2f} с", flush=True)
+    return result, stats
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmark(args, work_dir):
+    """Все этапы по очереди: загрузка, разбор, сводная матрица, Excel"""
+    periods = [(year, month) for year in args.years for month in range(1, 13)]
+    source_files = generate_exports(os.path.join(work_dir, 'source'), periods, args.partners, args.seed,
+                                    args.missing_rate)
+    source_bytes = sum(os.path.getsize(file_info['path']) for file_info in source_files)
+    stages = {}
+    
+    # Загрузка с локального сервера в пустой кэш
+    server = start_stub_server(source_files)
+    downloader.EXPORT_URL = f"http://127.0.0.1:{server.server_address[1]}/export.xml"
+    xml_cache.CACHE_DIR = os.path.join(work_dir, 'xml_cache')
+    download_dir = os.path.join(work_dir, 'download')
+    os.makedirs(download_dir, exist_ok=True)
+    
+    def download():
+        session = requests.Session()
+        with ThreadPoolExecutor(max_workers=args.download_workers) as executor:
+            return [result for result in executor.map(
+                lambda period: downloader.download_month(session, period[0], period[1], download_dir),
+                periods) if result]
+    
+    try:
+        xml_files, stages['download'] = measure('download', download, args.trace_allocations)
+    finally:
+        server.shutdown()
+        server.server_close()
+    if len(xml_files) != len(periods):
+        raise RuntimeError(f"Загружено {len(xml_files)} файлов из {len(periods)}")
+    stages['download'].update(files=len(xml_files), mb_per_s=round(source_bytes / 1024 / 1024 /
+                                                                  stages['download']['elapsed'], 1))
+    
+    # Разбор XML (при нескольких процессах выделения в дочерних процессах не учитываются)
+    (months, month_records), stages['parse'] = measure(
+        'parse', lambda: parse_month_records(list(xml_files), workers=args.parse_workers), args.trace_allocations)
+    records = sum(len(month) for month in month_records if month)
+    stages['parse'].update(records=records,
+                           records_per_s=round(records / stages['parse']['elapsed']),
+                           mb_per_s=round(source_bytes / 1024 / 1024 / stages['parse']['elapsed'], 1))
+    
+    # Сводная матрица партнеры x месяцы
+    matrix, stages['pivot'] = measure(
+        'pivot', lambda: RatingMatrix.from_month_records(months, month_records), args.trace_allocations)
+    stages['pivot'].update(partners=len(matrix), records_per_s=round(records / stages['pivot']['elapsed']))
+    
+    # Запись Excel-файлов обоих отчетов
+    excel_dir = os.path.join(work_dir, 'excel')
+    os.makedirs(excel_dir, exist_ok=True)
+    label = str(args.years[0]) if len(args.years) == 1 else f"{args.years[0]}-{args.years[-1]}"
+    excel_files, stages['excel'] = measure(
+        'excel', lambda: generate_reports(matrix, ['free', 'paid'], label, list(range(1, 13)), excel_dir),
+        args.trace_allocations)
+    cells = len(matrix) * (2 * len(periods) + 2) * len(excel_files)
+    stages['excel'].update(files=len(excel_files), cells_per_s=round(cells / stages['excel']['elapsed']),
+                           output_mb=round(sum(os.path.getsize(file_info['path'])
+                                               for file_info in excel_files) / 1024 / 1024, 1))
+    
+    return {
+        'revision': _git_revision(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'years': args.years,
+            'partners': args.partners,
+            'seed': args.seed,
+            'missing_rate': args.missing_rate,
+            'download_workers': args.download_workers,
+            'parse_workers': args.parse_workers,
+            'source_mb': round(source_bytes / 1024 / 1024, 1)
+        },
+        'stages': stages,
+        'total_elapsed': round(sum(stage['elapsed'] for stage in stages.values()), 4)
+    }
+
+def compare(result, previous):
+    """Сравнение времени этапов с результатом прошлого запуска"""
+    if previous.get('params') != result['params']:
+        print("Внимание: параметры запусков различаются")
+    print(f"Сравнение с {previous.get('revision')} ({previous.get('started_at')}):")
+    for name, stage in result['stages'].items():
+        old = previous.get('stages', {}).get(name)
+        if old and old.get('elapsed'):
+            ratio = stage['elapsed'] / old['elapsed']
+            print(f"  {name:<10} {old['elapsed']:8.2f} с -> {stage['elapsed']:8.2f} с ({ratio:.2f}x)")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--years', type=int, nargs='+', default=[2024])
+    arg_parser.add_argument('--partners', type=int, default=3000)
+    arg_parser.add_argument('--missing-rate', type=float, default=0.05)
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('--download-workers', type=int, default=downloader.DEFAULT_MAX_WORKERS)
+    arg_parser.add_argument('--parse-workers', type=int, default=0)
+    arg_parser.add_argument('--trace-allocations', action='store_true',
+                            help="замер выделений памяти через tracemalloc (замедляет этапы)")
+    arg_parser.add_argument('--output', help="файл для сохранения результатов в JSON")
+    arg_parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    args = arg_parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = run_benchmark(args, work_dir)
+    
+    print(f"Всего: {result['total_elapsed']:.2f} с, пик памяти процесса: {_process_peak_rss_mb()} МБ")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
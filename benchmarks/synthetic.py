@@ -0,0 +1,158 @@
+"""Генератор синтетических выгрузок рейтинга реалистичного размера
+
+Запуск: python -m benchmarks.synthetic --out data --years 2024 2025 --partners 5000
+"""
+import os
+import random
+import argparse
+from xml.sax.saxutils import escape
+
+# Регионы и города, по которым распределяются партнеры
+REGIONS = {
+    'Кыргызстан': ['Бишкек', 'Ош', 'Джалал-Абад', 'Каракол', 'Токмок'],
+    'Казахстан': ['Алматы', 'Астана', 'Шымкент', 'Караганда', 'Актобе', 'Павлодар'],
+    'Узбекистан': ['Ташкент', 'Самарканд', 'Бухара', 'Наманган'],
+    'Таджикистан': ['Душанбе', 'Худжанд'],
+}
+
+# Кодировки файлов по кругу: с декларацией, с BOM и cp1251 без декларации
+ENCODINGS = ('utf-8', 'windows-1251', 'utf-8-sig', 'cp1251-undeclared')
+
+# Поля, которые могут отсутствовать или быть пустыми в выгрузке
+OPTIONAL_FIELDS = (
+    'city', 'all_change', 'free_change', 'paid_change', 'perf_change',
+    'paid_drop', 'free_drop', 'share', 'share_change', 'in_order', 'perf_ratio'
+)
+
+_NAME_PREFIXES = ('1С', 'Софт', 'Бизнес', 'Учет', 'Инфо', 'Сервис', 'Центр', 'Альфа', 'Рога & Копыта')
+_NAME_SUFFIXES = ('Консалт', 'Системы', 'Эксперт', 'Партнер', 'Групп', 'Лтд', 'Плюс', 'Решения')
+
+def _change(new, old):
+    """Изменение в процентах относительно прошлого месяца"""
+    return (new - old) / old * 100 if old else 0.0
+
+def _signed(value, suffix=''):
+    return f"{value:+.2f}{suffix}".replace('+0.00', '0')
+
+def make_partners(count, rng):
+    """Список партнеров с регионом, городом и начальными значениями"""
+    partners = []
+    for idx in range(count):
+        region = rng.choice(list(REGIONS))
+        partners.append({
+            'name': f"{rng.choice(_NAME_PREFIXES)}-{rng.choice(_NAME_SUFFIXES)} {idx}",
+            'region': region,
+            'city': rng.choice(REGIONS[region]),
+            # Часть партнеров появляется позже или уходит из рейтинга
+            'joined': rng.random() < 0.1,
+            'leaves': rng.random() < 0.05,
+            'free_amount': int(rng.paretovariate(1.5) * 5),
+            'paid_amount': int(rng.paretovariate(1.2) * 40),
+        })
+    return partners
+
+def _month_rows(partners, month_index, periods_total, missing_rate, rng):
+    """Строки партнеров за месяц с пересчетом значений и мест"""
+    rows = []
+    for partner in partners:
+        if partner['joined'] and month_index < periods_total // 3:
+            continue
+        if partner['leaves'] and month_index > 2 * periods_total // 3:
+            continue
+        
+        previous = partner['free_amount'], partner['paid_amount']
+        partner['free_amount'] = max(0, partner['free_amount'] + rng.randint(-2, 2))
+        partner['paid_amount'] = max(0, int(partner['paid_amount'] * rng.uniform(0.95, 1.07)))
+        rows.append((partner, previous))
+    
+    rows.sort(key=lambda row: -(row[0]['free_amount'] + row[0]['paid_amount']))
+    total = sum(partner['free_amount'] + partner['paid_amount'] for partner, _ in rows) or 1
+    
+    for place, (partner, (prev_free, prev_paid)) in enumerate(rows, 1):
+        free, paid = partner['free_amount'], partner['paid_amount']
+        fields = {
+            'place': str(place),
+            'region': partner['region'],
+            'city': partner['city'],
+            'name': partner['name'],
+            'all_subs': f"{free + paid} ({_signed(_change(free + paid, prev_free + prev_paid), '%')})",
+            'all_amount': str(free + paid),
+            'all_change': _signed(_change(free + paid, prev_free + prev_paid)),
+            'free_subs': f"{free} ({_signed(_change(free, prev_free), '%')})",
+            'free_amount': str(free),
+            'free_change': _signed(_change(free, prev_free)),
+            'paid_subs': f"{paid} ({_signed(_change(paid, prev_paid), '%')})",
+            'paid_amount': str(paid),
+            'paid_change': _signed(_change(paid, prev_paid)),
+            'perf_subs': str(paid // 50),
+            'perf_amount': str(paid // 50),
+            'perf_change': '0',
+            'movement': '',
+            'duo_subs': str(paid // 200),
+            'duo_amount': str(paid // 200),
+            'otchetnost': str(rng.randint(0, 20)),
+            'paid_drop': f"{rng.uniform(0, 30):.2f}%",
+            'free_drop': f"{rng.uniform(0, 90):.2f}%",
+            'share': f"{(free + paid) / total * 100:.2f}%",
+            'share_change': f"{rng.uniform(-2, 2):.2f}%",
+            'status': '',
+            'in_order': rng.choice(('Да', 'Нет')),
+            'perf_ratio': rng.choice(('Да', 'Нет')),
+        }
+        
+        # Пропущенные и пустые поля, как в реальных выгрузках
+        for field in OPTIONAL_FIELDS:
+            roll = rng.random()
+            if roll < missing_rate / 2:
+                del fields[field]
+            elif roll < missing_rate:
+                fields[field] = ''
+        yield fields
+
+def write_month_file(path, rows, encoding):
+    """Запись XML-файла за месяц в заданной кодировке"""
+    declared = {'utf-8': 'UTF-8', 'utf-8-sig': 'UTF-8', 'windows-1251': 'windows-1251'}.get(encoding)
+    file_encoding = 'cp1251' if encoding == 'cp1251-undeclared' else encoding
+    
+    with open(path, 'w', encoding=file_encoding, newline='\n') as f:
+        if declared:
+            f.write(f'<?xml version="1.0" encoding="{declared}"?>\n')
+        f.write('<partners>\n')
+        for fields in rows:
+            f.write('\t<partner>\n')
+            for tag, value in fields.items():
+                f.write(f"\t\t<{tag}>{escape(value)}</{tag}>\n")
+            f.write('\t</partner>\n')
+        f.write('</partners>')
+
+def generate_exports(out_dir, periods, partners=3000, seed=1, missing_rate=0.05, encodings=ENCODINGS):
+    """Выгрузки за периоды (год, месяц) в out_dir, возвращает список файлов как у загрузчика"""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    partner_list = make_partners(partners, rng)
+    periods = sorted(periods)
+    
+    xml_files = []
+    for month_index, (year, month) in enumerate(periods):
+        path = os.path.join(out_dir, f"export_{year}_{month:02d}.xml")
+        rows = _month_rows(partner_list, month_index, len(periods), missing_rate, rng)
+        write_month_file(path, rows, encodings[month_index % len(encodings)])
+        xml_files.append({'path': path, 'year': int(year), 'month': month})
+    return xml_files
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--out', required=True)
+    arg_parser.add_argument('--years', type=int, nargs='+', default=[2024])
+    arg_parser.add_argument('--partners', type=int, default=3000)
+    arg_parser.add_argument('--missing-rate', type=float, default=0.05)
+    arg_parser.add_argument('--seed', type=int, default=1)
+    args = arg_parser.parse_args()
+    
+    periods = [(year, month) for year in args.years for month in range(1, 13)]
+    xml_files = generate_exports(args.out, periods, args.partners, args.seed, args.missing_rate)
+    size = sum(os.path.getsize(file_info['path']) for file_info in xml_files)
+    print(f"Файлов: {len(xml_files)}, партнеров: {args.partners}, объем: {size / 1024 / 1024:.1f} МБ")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
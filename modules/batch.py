@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import shutil
+import getpass
+import zipfile
+import argparse
+import tempfile
+import itertools
+from modules.downloader import REGION, CITY, DEFAULT_MAX_WORKERS, download_batch
+from modules.excel_generator import generate_reports
+from modules.partners import PartnerRegistry
+from modules.pipeline import (ReportError, no_stage, timed_stages, periods_by_year, job_temp_dir,
+                              create_test_xml_files, check_credentials, stored_months, month_digests,
+                              load_month_records, build_matrix)
+
+# Этапы формирования пакета отчетов в порядке выполнения
+BATCH_STAGES = ('download', 'parse', 'excel', 'archive')
+
+# Наибольшее количество отчетов в одном пакете
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 200))
+
+# Месяцы стандартных периодов
+PERIOD_MONTHS = {
+    'year': tuple(range(1, 13)),
+    'q1': (1, 2, 3),
+    'q2': (4, 5, 6),
+    'q3': (7, 8, 9),
+    'q4': (10, 11, 12)
+}
+
+# Типы отчетов по значению report_type
+REPORT_TYPE_CHOICES = {
+    'free': ('free',),
+    'paid': ('paid',),
+    'both': ('free', 'paid')
+}
+
+BATCH_TITLE = "Пакет отчетов 1C:ИТС"
+BATCH_FILE_TITLE = "Отчеты_1C_ИТС"
+
+def _parse_months(months):
+    """Месяцы из названия периода, строки "1,2,3" или списка"""
+    if isinstance(months, str):
+        if months in PERIOD_MONTHS:
+            return PERIOD_MONTHS[months]
+        months = months.split(',')
+    return tuple(sorted({int(month) for month in months}))
+
+def normalize_item(item):
+    """Проверка элемента пакета и приведение к виду {region, city, year, months, report_types}"""
+    try:
+        year = int(item['year'])
+        months = _parse_months(item.get('months') or item.get('period') or 'year')
+    except (KeyError, TypeError, ValueError):
+        raise ReportError(f"Неверный год или месяцы в элементе пакета: {item}")
+    if not months or not all(1 <= month <= 12 for month in months):
+        raise ReportError(f"Месяцы должны быть числами от 1 до 12: {item}")
+    
+    report_types = REPORT_TYPE_CHOICES.get(item.get('report_type') or 'both')
+    if report_types is None:
+        raise ReportError(f"Тип отчета должен быть free, paid или both: {item}")
+    
+    return {
+        'region': str(item.get('region') or REGION).strip(),
+        'city': str(item.get('city') or CITY).strip(),
+        'year': year,
+        'months': months,
+        'report_types': report_types
+    }
+
+def expand_matrix(regions, cities, years, periods, report_type='both'):
+    """Элементы пакета для всех сочетаний регионов, городов, лет и периодов"""
+    return [normalize_item({'region': region, 'city': city, 'year': year, 'months': months,
+                            'report_type': report_type})
+            for region, city, year, months in itertools.product(regions, cities, years, periods)]
+
+def plan_batch(items):
+    """План пакета: отчеты без повторов и наборы месяцев по каждому источнику (регион, город)"""
+    reports = {}
+    sources = {}
+    for item in items:
+        # Отчеты за одни и те же месяцы строятся одной книгой на все запрошенные типы
+        key = (item['region'], item['city'], item['year'], item['months'])
+        report_types = reports.setdefault(key, [])
+        report_types.extend(t for t in item['report_types'] if t not in report_types)
+        sources.setdefault(key[:2], set()).update((item['year'], month) for month in item['months'])
+    
+    return {
+        'reports': [{'region': region, 'city': city, 'year': year, 'months': months, 'report_types': report_types}
+                    for (region, city, year, months), report_types in reports.items()],
+        'sources': {source: sorted(periods) for source, periods in sources.items()}
+    }
+
+def _months_label(months):
+    for name, period_months in PERIOD_MONTHS.items():
+        if tuple(months) == period_months:
+            return name
+    return '-'.join(f"{month:02d}" for month in months)
+
+def _archive_dir(report):
+    """Каталог отчета внутри архива"""
+    city = report['city'] or "Все города"
+    return f"{report['region']}/{city}/{report['year']}_{_months_label(report['months'])}"
+
+def run_batch(items, params, temp_dir, stage=no_stage, download_workers=DEFAULT_MAX_WORKERS,
+              parse_workers=0, incremental=True):
+    """Пакет отчетов: каждый месяц загружается и разбирается один раз, результаты собираются в ZIP"""
+    stage = timed_stages(stage)
+    plan = plan_batch(items)
+    # Закрытые месяцы из хранилища выдаются только после авторизации, как и загруженные
+    check_credentials(params)
+    # Каталог пакета удаляется и при ошибке; готовый архив записывается вне его, в каталог сессии
+    with job_temp_dir(temp_dir, prefix='batch_') as batch_dir:
+        return _build_batch(plan, params, temp_dir, batch_dir, stage, download_workers, parse_workers, incremental)
+
+def _build_batch(plan, params, temp_dir, batch_dir, stage, download_workers, parse_workers, incremental):
+    """Этапы пакета с файлами в каталоге пакета"""
+    use_local_files = params.get('use_local_files')
+    # Тестовые данные в хранилище месяцев не попадают
+    incremental = incremental and not use_local_files
+    
+    source_dirs = {source: os.path.join(batch_dir, f"source_{idx}") for idx, source in enumerate(plan['sources'])}
+    states = {}
+    stored_periods = {}
+    for source, periods in plan['sources'].items():
+        states[source], stored_periods[source] = stored_months(*source, periods, incremental)
+    
+    # Все недостающие месяцы всех источников загружаются вместе через одну сессию
+    with stage('download'):
+        xml_files = {source: [] for source in plan['sources']}
+        missing = {source: [period for period in periods if period not in stored_periods[source]]
+                   for source, periods in plan['sources'].items()}
+        if use_local_files:
+            for source, periods in missing.items():
+                os.makedirs(source_dirs[source], exist_ok=True)
+                for year, months in periods_by_year(periods).items():
+                    xml_files[source].extend(create_test_xml_files(year, months, source_dirs[source]))
+        else:
+            tasks = [(*source, year, month, source_dirs[source])
+                     for source, periods in missing.items() for year, month in periods]
+            downloaded = download_batch(tasks, params['username'], params['password'], download_workers)
+            for (region, city, *_), file_info in sorted(downloaded.items()):
+                xml_files[(region, city)].append(file_info)
+    
+    if not any(xml_files.values()) and not any(stored_periods.values()):
+        raise ReportError("Не удалось загрузить XML файлы. Проверьте правильность учетных данных и подключение к интернету.")
+    
+    # Каждый источник разбирается один раз на все отчеты пакета
+    with stage('parse'):
+        month_records = {}
+        for source in plan['sources']:
+            digests, files_to_parse = month_digests(*source, states[source], stored_periods[source],
+                                                    xml_files[source])
+            month_records[source] = load_month_records(*source, stored_periods[source], files_to_parse,
+                                                       digests, incremental, parse_workers)
+    
+    with stage('excel'):
+        outputs = []
+        # Один справочник партнеров на пакет: строки общие для всех отчетов и освобождаются вместе с пакетом
+        registry = PartnerRegistry()
+        for idx, report in enumerate(plan['reports']):
+            matrix = build_matrix(month_records[(report['region'], report['city'])],
+                                  [(report['year'], month) for month in report['months']], registry=registry)
+            report_dir = os.path.join(batch_dir, f"report_{idx}")
+            os.makedirs(report_dir, exist_ok=True)
+            try:
+                excel_files = generate_reports(matrix, report['report_types'], str(report['year']),
+                                               list(report['months']), report_dir,
+                                               combined=params.get('combined', False))
+            except Exception as e:
+                raise ReportError(f"Произошла ошибка при создании Excel-файлов: {str(e)}")
+            archive_dir = _archive_dir(report)
+            outputs.extend((f"{archive_dir}/{os.path.basename(file_info['path'])}", file_info['path'])
+                           for file_info in excel_files)
+    
+    # Книги уже сжаты, поэтому в архив они записываются без повторного сжатия
+    with stage('archive'):
+        zip_path = os.path.join(temp_dir, f"{BATCH_FILE_TITLE}_{os.path.basename(batch_dir)}.zip")
+        # Архив собирается в каталоге пакета: недописанный архив удаляется вместе с ним
+        part_path = os.path.join(batch_dir, 'archive.zip.part')
+        with zipfile.ZipFile(part_path, 'w', zipfile.ZIP_STORED) as archive:
+            for archive_name, path in outputs:
+                archive.write(path, archive_name)
+        os.replace(part_path, zip_path)
+    
+    return [{'name': BATCH_TITLE, 'path': zip_path}]
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Пакет отчетов 1C:ИТС по регионам, городам и периодам")
+    arg_parser.add_argument('--items', help="JSON-файл со списком элементов {region, city, year, months, report_type}")
+    arg_parser.add_argument('--regions', nargs='+', default=[REGION])
+    arg_parser.add_argument('--cities', nargs='+', default=[CITY])
+    arg_parser.add_argument('--years', type=int, nargs='+')
+    arg_parser.add_argument('--periods', nargs='+', default=['year'], help="year, q1-q4 или месяцы через запятую")
+    arg_parser.add_argument('--report-type', choices=sorted(REPORT_TYPE_CHOICES), default='both')
+    arg_parser.add_argument('--combined', action='store_true', help="все типы отчетов на листах одной книги")
+    arg_parser.add_argument('--local', action='store_true', help="тестовые данные без загрузки с сайта")
+    arg_parser.add_argument('--username', default=os.environ.get('ITS_USERNAME'))
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS)
+    arg_parser.add_argument('--out', required=True, help="путь к ZIP-архиву с отчетами")
+    args = arg_parser.parse_args()
+    
+    if args.items:
+        with open(args.items, 'r', encoding='utf-8') as f:
+            items = [normalize_item(item) for item in json.load(f)]
+    elif args.years:
+        items = expand_matrix(args.regions, args.cities, args.years, args.periods, args.report_type)
+    else:
+        arg_parser.error("нужно указать --items или --years")
+    
+    params = {'use_local_files': args.local, 'combined': args.combined}
+    if not args.local:
+        params['username'] = args.username or input("Логин на сайте 1С: ")
+        params['password'] = os.environ.get('ITS_PASSWORD') or getpass.getpass("Пароль: ")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            result = run_batch(items, params, temp_dir, download_workers=args.workers)
+        except ReportError as e:
+            sys.exit(str(e))
+        shutil.move(result[0]['path'], args.out)
+    print(f"Отчетов: {len(plan_batch(items)['reports'])}, архив: {args.out}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
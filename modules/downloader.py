@@ -1,103 +1,263 @@
-import requests
 import os
-from bs4 import BeautifulSoup
-from datetime import datetime
+import time
+import hashlib
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from modules import xml_cache
+from modules import session_manager
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+# Количество одновременных загрузок по умолчанию
+DEFAULT_MAX_WORKERS = 4
+
+# Адрес выгрузки рейтинга (можно подменить зеркалом или тестовым сервером)
+EXPORT_URL = os.environ.get('RATING_EXPORT_URL', "https://its.1c.eu/partner/rating/export.xml")
+
+# Регион и город, за которые выгружается рейтинг по умолчанию
+REGION = "Кыргызстан"
+CITY = ""
+
+# Размер блока потоковой загрузки (в памяти одновременно находится не больше одного блока)
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+
+# Количество повторных попыток при сетевых ошибках и временных ответах сервера
+DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', 3))
+
+# Пауза перед первой повторной попыткой в секундах, дальше она удваивается
+DOWNLOAD_BACKOFF = float(os.environ.get('DOWNLOAD_BACKOFF', 1.0))
+
+# Таймаут соединения и ожидания данных в секундах
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', 60))
+
+# Проверка начала выгрузки на XML еще во время загрузки (1 - включено)
+VERIFY_XML = os.environ.get('DOWNLOAD_VERIFY_XML', '1') == '1'
 
-def login_to_1c(username, password):
-    """Авторизация на сайте 1С"""
-    login_url = "https://login.1c.ru/login?service=https%3A%2F%2Fits.1c.eu%2Flogin%2F%3Faction%3Daftercheck%26provider%3Dlogin"
-    session = requests.Session()
+# Ответы сервера, после которых запрос имеет смысл повторить
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Сколько первых байт выгрузки нужно для проверки на XML
+_SNIFF_BYTES = 64
+
+class DownloadError(Exception):
+    """Выгрузку не удалось загрузить целиком или она не является XML-файлом"""
+
+class _RetryableResponse(Exception):
+    """Временный ответ сервера при докачке"""
+
+def _month_url(year, month, region=REGION, city=CITY):
+    """URL выгрузки рейтинга за месяц"""
+    date_param = f"{month:02d}.{year}"
+    return f"{EXPORT_URL}?city={quote(city)}&region={quote(region)}&date={date_param}"
+
+def _looks_like_xml(head):
+    """Проверка начала выгрузки: XML-документ, а не HTML-страница (например, страница входа)"""
+    head = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if head.startswith(b'<?xml'):
+        return True
+    return head.startswith(b'<') and not head.startswith((b'<!doctype html', b'<html'))
+
+def _backoff(attempt):
+    metrics.increment('download_retries')
+    time.sleep(DOWNLOAD_BACKOFF * 2 ** attempt)
+
+def _get(session, url, headers):
+    """GET-запрос с потоковым телом и повторами при сетевых ошибках и ответах 429/5xx"""
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            response = session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+        else:
+            if response.status_code not in _RETRY_STATUSES or attempt == DOWNLOAD_RETRIES:
+                return response
+            response.close()
+        _backoff(attempt)
+
+def _stream_to_file(session, url, response, path):
+    """Запись тела ответа на диск блоками с подсчетом sha256, при обрыве - докачка через Range"""
+    sha256 = hashlib.sha256()
+    written = 0
+    head = b''
+    resumable = False
+    etag = response.headers.get('ETag')
     
-    # Базовые заголовки для всех запросов
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    with open(path, 'wb') as f:
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            retry_headers = None
+            try:
+                if response is None:
+                    # Докачиваем с места обрыва, если сервер поддерживает Range, иначе загружаем заново
+                    retry_headers = {}
+                    if resumable and written:
+                        retry_headers = {'Range': f"bytes={written}-", 'Accept-Encoding': 'identity'}
+                        if etag:
+                            retry_headers['If-Range'] = etag
+                    response = session.get(url, headers=retry_headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+                
+                with response:
+                    if retry_headers is not None:
+                        if response.status_code in _RETRY_STATUSES:
+                            raise _RetryableResponse(response.status_code)
+                        if response.status_code == 206 and 'Range' in retry_headers:
+                            content_range = response.headers.get('Content-Range', '')
+                            if not content_range.startswith(f"bytes {written}-"):
+                                raise DownloadError(f"неверный диапазон докачки {content_range}")
+                        elif response.status_code == 200:
+                            f.seek(0)
+                            f.truncate()
+                            sha256 = hashlib.sha256()
+                            written = 0
+                            head = b''
+                        else:
+                            raise DownloadError(f"ответ сервера {response.status_code} при повторной загрузке")
+                    
+                    encoded = bool(response.headers.get('Content-Encoding'))
+                    if response.status_code == 200:
+                        # Range считается в байтах передачи, поэтому сжатый ответ докачать нельзя
+                        resumable = response.headers.get('Accept-Ranges') == 'bytes' and not encoded
+                    length = response.headers.get('Content-Length')
+                    expected = written + int(length) if length and not encoded else None
+                    
+                    # gzip и deflate распаковываются по мере чтения блоков
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        if VERIFY_XML and head is not None:
+                            head += chunk
+                            if len(head) >= _SNIFF_BYTES:
+                                if not _looks_like_xml(head):
+                                    raise DownloadError("ответ сервера не является XML-файлом")
+                                head = None
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        written += len(chunk)
+                    
+                    if expected is not None and written < expected:
+                        raise requests.ConnectionError(f"получено {written} байт из {expected}")
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    _RetryableResponse):
+                response = None
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                _backoff(attempt)
+    
+    # Выгрузка короче _SNIFF_BYTES проверяется целиком
+    if VERIFY_XML and head and not _looks_like_xml(head):
+        raise DownloadError("ответ сервера не является XML-файлом")
+    return sha256.hexdigest(), written
+
+def _month_file_info(file_path, year, month, started, source):
+    elapsed = time.perf_counter() - started
+    # cache и revalidated - попадания в кэш, network - промах
+    metrics.observe('download_month', elapsed, source=source)
+    metrics.increment('xml_files', source=source)
+    return {
+        'path': file_path,
+        'year': int(year),
+        'month': month,
+        'elapsed': elapsed,
+        'source': source
     }
-    session.headers.update(headers)
+
+def download_month(session, year, month, temp_dir, relogin=None, region=REGION, city=CITY):
+    """Загрузка XML-файла за один месяц"""
+    started = time.perf_counter()
+    filename = f"export_{year}_{month:02d}.xml"
+    file_path = os.path.join(temp_dir, filename)
+    key = xml_cache.cache_key(region, city, year, month)
+    url = _month_url(year, month, region, city)
     
+    # Сначала проверяем общий кэш
+    entry = xml_cache.lookup(key)
+    if entry and xml_cache.is_fresh(entry, year, month):
+        xml_cache.materialize(entry, file_path)
+        return _month_file_info(file_path, year, month, started, 'cache')
+    
+    if session is None:
+        return None
+    
+    part_path = f"{file_path}.part"
     try:
-        # Получаем страницу авторизации
-        response = session.get(login_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        # Загружаем файл, для закэшированного месяца - условным запросом
+        headers = xml_cache.revalidation_headers(entry) if entry else {}
+        response = _get(session, url, headers)
         
-        # Находим форму и скрытые поля
-        login_form = soup.find('form', {'id': 'loginForm'}) or soup.find('form')
-        if not login_form:
-            return None
+        # Сессия истекла на сервере - авторизуемся заново и повторяем запрос
+        if relogin and session_manager.is_login_redirect(response):
+            response.close()
+            session = relogin(session)
+            if session is None:
+                return None
+            response = _get(session, url, headers)
         
-        # Получаем скрытые поля
-        hidden_fields = {}
-        for field in login_form.find_all('input', {'type': 'hidden'}):
-            name = field.get('name')
-            if name:
-                hidden_fields[name] = field.get('value', '')
+        if response.status_code == 304 and entry:
+            # Данные на сервере не изменились
+            response.close()
+            xml_cache.mark_revalidated(key)
+            xml_cache.materialize(entry, file_path)
+            return _month_file_info(file_path, year, month, started, 'revalidated')
         
-        # URL для отправки формы
-        form_action = login_form.get('action', '')
-        if form_action.startswith('/'):
-            submit_url = f"https://login.1c.ru{form_action}"
+        if response.status_code == 200:
+            # Файл пишется на диск по мере загрузки, не собираясь целиком в памяти
+            digest, size = _stream_to_file(session, url, response, part_path)
+            
+            # Проверяем, что файл не пустой
+            if size:
+                metrics.increment('download_bytes', size)
+                entry = xml_cache.store_file(
+                    key, part_path, digest,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
+                )
+                xml_cache.materialize(entry, file_path)
+                return _month_file_info(file_path, year, month, started, 'network')
+            logger.warning("Пустой файл выгрузки за %02d.%s", month, year)
         else:
-            submit_url = form_action or login_url
-        
-        # Данные для авторизации
-        form_data = {
-            'username': username,
-            'password': password,
-            **hidden_fields
-        }
-        
-        # Отправляем форму
-        login_response = session.post(
-            submit_url, 
-            data=form_data,
-            headers={'Referer': login_url},
-            allow_redirects=True
-        )
-        
-        # Проверяем успешность авторизации
-        if 'its.1c.eu' in login_response.url:
-            return session
+            response.close()
+            logger.warning("Выгрузка за %02d.%s: ответ сервера %s", month, year, response.status_code)
+    except DownloadError as e:
+        logger.warning("Выгрузка за %02d.%s отклонена: %s", month, year, e)
     except Exception:
-        pass
+        logger.exception("Ошибка загрузки выгрузки за %02d.%s", month, year)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
     
+    metrics.increment('download_failures')
     return None
 
-def download_xml_files(year, months, temp_dir, username, password):
-    """Загрузка XML-файлов с сайта 1С"""
-    session = login_to_1c(username, password)
-    if not session:
-        return []
+def download_batch(tasks, username, password, max_workers=DEFAULT_MAX_WORKERS):
+    """Загрузка месяцев [(регион, город, год, месяц, каталог)] через одну общую сессию"""
+    # Одинаковые задачи загружаются один раз
+    tasks = sorted(set(tasks))
     
-    os.makedirs(temp_dir, exist_ok=True)
-    base_url = "https://its.1c.eu/partner/rating/export.xml"
-    region_param = "%D0%9A%D1%8B%D1%80%D0%B3%D1%8B%D0%B7%D1%81%D1%82%D0%B0%D0%BD"  # "Кыргызстан"
+    # Учетные данные проверяются всегда, даже если все месяцы есть в кэше:
+    # кэш общий для всех пользователей. Известная сессия берется из памяти без запроса к сайту
+    session = session_manager.get_session(username, password)
+    if not session:
+        return {}
     
-    downloaded_files = []
+    def relogin(stale_session):
+        return session_manager.relogin(username, password, stale_session)
     
-    for month in months:
-        # Формируем URL для загрузки
-        date_param = f"{month:02d}.{year}"
-        url = f"{base_url}?city=&region={region_param}&date={date_param}"
-        
-        try:
-            # Загружаем файл
-            response = session.get(url, stream=True)
-            
-            if response.status_code == 200:
-                # Сохраняем файл
-                filename = f"export_{year}_{month:02d}.xml"
-                file_path = os.path.join(temp_dir, filename)
-                
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                
-                # Проверяем, что это XML-файл
-                if os.path.getsize(file_path) > 0:
-                    downloaded_files.append({
-                        'path': file_path,
-                        'year': int(year),
-                        'month': month
-                    })
-        except Exception:
-            pass
+    def download(task):
+        region, city, year, month, temp_dir = task
+        os.makedirs(temp_dir, exist_ok=True)
+        return download_month(session, year, month, temp_dir, relogin, region=region, city=city)
     
-    return downloaded_files
\ No newline at end of file
+    # Загружаем месяцы параллельно, не более max_workers одновременно
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = executor.map(download, tasks)
+        return {task: result for task, result in zip(tasks, results) if result}
+
+def download_xml_files(year, months, temp_dir, username, password, max_workers=DEFAULT_MAX_WORKERS,
+                       region=REGION, city=CITY):
+    """Загрузка XML-файлов с сайта 1С"""
+    os.makedirs(temp_dir, exist_ok=True)
+    downloaded = download_batch([(region, city, year, month, temp_dir) for month in months],
+                                username, password, max_workers)
+    return [downloaded[task] for task in sorted(downloaded)]
\ No newline at end of file
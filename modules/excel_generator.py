@@ -1,138 +1,271 @@
 import os
+import threading
+from tempfile import SpooledTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import CellIsRule
 from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.utils import get_column_letter
+from modules.ratings_matrix import RatingMatrix, select_rows
+from modules import metrics
 
-def generate_excel_files(parsed_data, report_type, year, months, temp_dir):
-    """Создание Excel файлов с отчетами"""
-    # Определяем тип отчета
-    if report_type == 'free':
-        file_title = f"Льготные_1C_ИТС_{year}"
-        data_key = 'free_data'
-        title = "Льготные 1C:ИТС"
-    else:  # 'paid'
-        file_title = f"Платные_1C_ИТС_{year}"
-        data_key = 'paid_data'
-        title = "Платные 1C:ИТС"
-    
-    # Проверяем наличие данных
-    if not parsed_data['months'] or not parsed_data['partners']:
-        empty_path = os.path.join(temp_dir, f"{file_title}.xlsx")
-        
-        # Создаем пустой файл
-        df = pd.DataFrame({"Сообщение": ["Нет данных для отчета"]})
-        df.to_excel(empty_path, index=False, sheet_name="Отчет")
+# Общие стили, создаются один раз на все ячейки
+HEADER_FONT = Font(bold=True)
+CENTER_ALIGNMENT = Alignment(horizontal='center')
+MONTH_HEADER_FILL = PatternFill(start_color='C9DAF8', end_color='C9DAF8', fill_type='solid')
+DIFF_HEADER_FILL = PatternFill(start_color='D9EAD3', end_color='D9EAD3', fill_type='solid')
+POSITIVE_FONT = Font(color='006100')  # Зеленый для положительных
+NEGATIVE_FONT = Font(color='9C0006')  # Красный для отрицательных
+
+# Текстовые колонки отчета, остальные колонки числовые
+TEXT_COLUMNS = ("Название", "Город")
+
+# Типы отчетов: поле данных, имя файла, название и лист в общей книге
+REPORT_TYPES = {
+    'free': {
+        'field': 'free_amount',
+        'file_title': "Льготные_1C_ИТС_{year}",
+        'title': "Льготные 1C:ИТС",
+        'sheet_name': "Льготные"
+    },
+    'paid': {
+        'field': 'paid_amount',
+        'file_title': "Платные_1C_ИТС_{year}",
+        'title': "Платные 1C:ИТС",
+        'sheet_name': "Платные"
+    }
+}
+
+# Имя файла книги со всеми отчетами на отдельных листах
+COMBINED_FILE_TITLE = "Отчеты_1C_ИТС_{year}"
+
+# Книги в памяти больше этого размера переносятся во временный файл (по умолчанию 16 МБ)
+SPOOL_MAX_BYTES = int(os.environ.get('SPOOL_MAX_BYTES', 16 * 1024 * 1024))
+
+class SpooledWorkbook:
+    """Готовая книга в памяти (большая - во временном файле без имени) для отдачи частями"""
+    
+    def __init__(self, max_size=SPOOL_MAX_BYTES):
+        self.file = SpooledTemporaryFile(max_size=max_size)
+        self._lock = threading.Lock()
+    
+    @property
+    def size(self):
+        with self._lock:
+            return self.file.seek(0, os.SEEK_END)
+    
+    def iter_chunks(self, chunk_size=64 * 1024):
+        """Содержимое книги частями; одновременные загрузки читают файл независимо"""
+        offset = 0
+        while True:
+            with self._lock:
+                self.file.seek(offset)
+                chunk = self.file.read(chunk_size)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+    
+    def close(self):
+        # Книга не закрывается посреди чтения части для загрузки
+        with self._lock:
+            self.file.close()
+
+def _write_report_sheet(workbook, df, sheet_name):
+    """Запись таблицы отчета на лист книги в режиме write-only"""
+    worksheet = workbook.create_sheet(sheet_name)
+    columns = list(df.columns)
+    
+    # Ширина колонок задается до записи строк
+    for col_num, column in enumerate(columns, 1):
+        column_letter = get_column_letter(col_num)
+        # Устанавливаем базовую ширину
+        max_length = max(len(str(column)), 12)
+        worksheet.column_dimensions[column_letter].width = max_length + 2
+    
+    # Форматируем заголовки
+    header = []
+    for column_title in columns:
+        cell = WriteOnlyCell(worksheet, value=column_title)
+        cell.font = HEADER_FONT
+        cell.alignment = CENTER_ALIGNMENT
         
-        return empty_path
+        # Выделяем разницы цветом
+        cell.fill = DIFF_HEADER_FILL if 'Разница' in column_title else MONTH_HEADER_FILL
+        header.append(cell)
+    worksheet.append(header)
+    
+    # Числовые колонки выравниваются по центру: одна ячейка со стилем
+    # на колонку, строка записывается сразу при append
+    styled_cells = []
+    for column_title in columns:
+        if column_title in TEXT_COLUMNS:
+            styled_cells.append(None)
+        else:
+            cell = WriteOnlyCell(worksheet)
+            cell.alignment = CENTER_ALIGNMENT
+            styled_cells.append(cell)
+    
+    for values in df.itertuples(index=False, name=None):
+        row = []
+        for cell, value in zip(styled_cells, values):
+            if cell is None:
+                row.append(value)
+            else:
+                cell.value = value
+                row.append(cell)
+        worksheet.append(row)
     
+    # Цвет разниц задается условным форматированием, а не шрифтом каждой ячейки
+    if len(df):
+        diff_ranges = ' '.join(
+            f"{get_column_letter(col_num)}2:{get_column_letter(col_num)}{len(df) + 1}"
+            for col_num, column_title in enumerate(columns, 1)
+            if 'Разница' in column_title
+        )
+        if diff_ranges:
+            worksheet.conditional_formatting.add(
+                diff_ranges, CellIsRule(operator='greaterThan', formula=['0'], font=POSITIVE_FONT))
+            worksheet.conditional_formatting.add(
+                diff_ranges, CellIsRule(operator='lessThan', formula=['0'], font=NEGATIVE_FONT))
+    
+    return worksheet
+
+def _month_columns(parsed_data):
+    """Общий для всех отчетов порядок месяцев и названия колонок"""
     # Сортируем месяцы
-    sorted_months = sorted(parsed_data['months'], key=lambda x: (x['year'], x['month']))
-    
-    # Создаем список колонок основной информации
-    columns = ["Номер", "Название", "Город"]
-    
-    # Создаем данные для таблицы
-    rows = []
-    for idx, (name, partner_data) in enumerate(parsed_data['partners'].items(), 1):
-        row = {
-            "Номер": idx,
-            "Название": name,
-            "Город": partner_data['city']
-        }
-        
-        # Добавляем данные по месяцам
-        for i, month_info in enumerate(sorted_months):
-            month_key = month_info['key']
-            month_name = f"{month_info['month']:02d}.{year}"
-            
-            # Значение за месяц
-            month_value = partner_data[data_key].get(month_key, 0)
-            row[month_name] = month_value
-            
-            # Если есть следующий месяц, добавляем разницу
-            if i < len(sorted_months) - 1:
-                next_month_info = sorted_months[i+1]
-                next_month_key = next_month_info['key']
-                next_month_name = f"{next_month_info['month']:02d}.{year}"
-                
-                next_value = partner_data[data_key].get(next_month_key, 0)
-                diff = next_value - month_value
-                
-                diff_col = f"Разница {month_name}-{next_month_name}"
-                row[diff_col] = diff
-        
-        rows.append(row)
+    month_order = sorted(range(len(parsed_data.months)),
+                         key=lambda col: (parsed_data.months[col]['year'], parsed_data.months[col]['month']))
+    sorted_months = [parsed_data.months[col] for col in month_order]
     
-    # Формируем полный список колонок с учетом чередования месяцев и разниц
-    all_columns = ["Номер", "Название", "Город"]
+    # Названия колонок месяцев и разниц формируем один раз
+    # Год берется из самого месяца, чтобы отчет мог охватывать несколько лет
+    month_names = [f"{month_info['month']:02d}.{month_info['year']}" for month_info in sorted_months]
+    diff_names = [f"Разница {month_name}-{next_month_name}"
+                  for month_name, next_month_name in zip(month_names, month_names[1:])]
     
-    for i, month_info in enumerate(sorted_months):
-        month_name = f"{month_info['month']:02d}.{year}"
-        all_columns.append(month_name)
-        
-        # Добавляем колонку с разницей после месяца (если не последний месяц)
-        if i < len(sorted_months) - 1:
-            next_month_info = sorted_months[i+1]
-            next_month_name = f"{next_month_info['month']:02d}.{year}"
-            diff_col = f"Разница {month_name}-{next_month_name}"
-            all_columns.append(diff_col)
+    # Колонки данных с учетом чередования месяцев и разниц
+    data_columns = [None] * (2 * len(month_names) - 1)
+    data_columns[0::2] = month_names
+    data_columns[1::2] = diff_names
     
-    # Создаем DataFrame
-    df = pd.DataFrame(rows)
+    return month_order, month_names, data_columns
+
+def _build_report_table(parsed_data, field, month_order, month_names, data_columns, top_n=None, min_change=None):
+    """Таблица отчета по одному полю с разницами, отсортированная по последнему месяцу"""
+    values = parsed_data.values[field][:, month_order].astype(np.int64)
+    names = parsed_data.names
+    cities = parsed_data.cities
+    
+    # Таблица строится только для отобранных партнеров
+    if top_n or min_change:
+        rows = select_rows(values, top_n, min_change)
+        values = values[rows]
+        names = [names[row] for row in rows.tolist()]
+        cities = [cities[row] for row in rows.tolist()]
     
-    # Сортируем по последнему месяцу (если есть)
-    if sorted_months:
-        last_month = f"{sorted_months[-1]['month']:02d}.{year}"
-        df = df.sort_values(by=last_month, ascending=False).reset_index(drop=True)
-        df['Номер'] = range(1, len(df) + 1)
+    # Значения и разницы между соседними месяцами в одной широкой таблице
+    table = np.empty((len(values), len(data_columns)), dtype=np.int64)
+    table[:, 0::2] = values
+    table[:, 1::2] = np.diff(values, axis=1)
+    
+    # Создаем DataFrame
+    df = pd.DataFrame(table, columns=data_columns)
+    df.insert(0, "Номер", np.arange(1, len(df) + 1, dtype=np.int64))
+    df.insert(1, "Название", names)
+    df.insert(2, "Город", cities)
     
-    # Переупорядочиваем колонки
-    df = df[all_columns]
+    # Сортируем по последнему месяцу
+    df = df.sort_values(by=month_names[-1], ascending=False).reset_index(drop=True)
+    df['Номер'] = range(1, len(df) + 1)
+    return df
+
+def _save_workbook(sheets, target):
+    """Сохранение листов [(название, DataFrame)] в одну книгу (путь или файловый объект)"""
+    workbook = Workbook(write_only=True)
+    for sheet_name, df in sheets:
+        with metrics.span('excel_sheet'):
+            _write_report_sheet(workbook, df, sheet_name)
+    with metrics.span('excel_save'):
+        workbook.save(target)
+    return target
+
+def _save_empty_workbook(target):
+    """Создание файла-заглушки, когда данных для отчета нет"""
+    df = pd.DataFrame({"Сообщение": ["Нет данных для отчета"]})
+    df.to_excel(target, index=False, sheet_name="Отчет")
+    return target
+
+def _write_output(name, file_title, temp_dir, output, write):
+    """Запись книги в файл в temp_dir или в память, возвращает описание файла отчета"""
+    if output == 'memory':
+        workbook = SpooledWorkbook()
+        write(workbook.file)
+        return {'name': name, 'workbook': workbook}
     
-    # Сохраняем в Excel
+    # Книга записывается в новый файл и только готовой подменяет файл с тем же именем
     file_path = os.path.join(temp_dir, f"{file_title}.xlsx")
+    part_path = f"{file_path}.part"
+    try:
+        with open(part_path, 'wb') as f:
+            write(f)
+        os.replace(part_path, file_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return {'name': name, 'path': file_path}
+
+def generate_reports(parsed_data, report_types, year, months, temp_dir, combined=False, output='disk',
+                     top_n=None, min_change=None):
+    """Создание отчетов нескольких типов за один проход по данным (output='memory' - без файлов на диске)"""
+    # Словарный вид данных переводим в матрицы
+    if isinstance(parsed_data, dict):
+        parsed_data = RatingMatrix.from_dict(parsed_data)
     
-    # Создаем Excel с форматированием
-    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Отчет')
-        
-        # Получаем объекты книги и листа
-        workbook = writer.book
-        worksheet = writer.sheets['Отчет']
-        
-        # Форматируем заголовки
-        for col_num, column_title in enumerate(df.columns, 1):
-            cell = worksheet.cell(row=1, column=col_num)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-            
-            # Выделяем разницы цветом
-            if 'Разница' in column_title:
-                cell.fill = PatternFill(start_color='D9EAD3', end_color='D9EAD3', fill_type='solid')
-            else:
-                cell.fill = PatternFill(start_color='C9DAF8', end_color='C9DAF8', fill_type='solid')
-        
-        # Форматируем числовые ячейки и разницы
-        for row_idx in range(2, len(df) + 2):
-            for col_idx, col_name in enumerate(df.columns, 1):
-                cell = worksheet.cell(row=row_idx, column=col_idx)
-                
-                # Форматирование числовых ячеек
-                if isinstance(cell.value, (int, float)):
-                    cell.alignment = Alignment(horizontal='center')
-                    
-                    # Выделение положительных/отрицательных значений разницы
-                    if 'Разница' in col_name:
-                        if cell.value > 0:
-                            cell.font = Font(color='006100')  # Зеленый для положительных
-                        elif cell.value < 0:
-                            cell.font = Font(color='9C0006')  # Красный для отрицательных
-        
-        # Автоподбор ширины колонок
-        for col_num, column in enumerate(df.columns, 1):
-            column_letter = get_column_letter(col_num)
-            # Устанавливаем базовую ширину
-            max_length = max(len(str(column)), 12)
-            worksheet.column_dimensions[column_letter].width = max_length + 2
-    
-    return file_path
\ No newline at end of file
+    report_types = [report_type for report_type in REPORT_TYPES if report_type in report_types]
+    if not report_types:
+        return []
+    has_data = bool(parsed_data.months) and len(parsed_data) > 0
+    
+    # Порядок месяцев и колонки общие для всех отчетов
+    if has_data:
+        month_order, month_names, data_columns = _month_columns(parsed_data)
+    
+    reports = []
+    for report_type in report_types:
+        report = dict(REPORT_TYPES[report_type], type=report_type)
+        report['file_title'] = report['file_title'].format(year=year)
+        if has_data:
+            with metrics.span('excel_table'):
+                report['df'] = _build_report_table(
+                    parsed_data, report['field'], month_order, month_names, data_columns, top_n, min_change)
+        reports.append(report)
+    
+    # Все отчеты на отдельных листах одной книги
+    if combined:
+        name = ' и '.join(report['sheet_name'] for report in reports) + ' 1C:ИТС'
+        sheets = [(report['sheet_name'], report['df']) for report in reports] if has_data else None
+        return [_write_output(
+            name, COMBINED_FILE_TITLE.format(year=year), temp_dir, output,
+            lambda target: _save_workbook(sheets, target) if has_data else _save_empty_workbook(target)
+        )]
+    
+    def save(report):
+        return _write_output(
+            report['title'], report['file_title'], temp_dir, output,
+            lambda target: _save_workbook([('Отчет', report['df'])], target) if has_data
+            else _save_empty_workbook(target)
+        )
+    
+    # Отдельные книги записываем одновременно
+    with ThreadPoolExecutor(max_workers=len(reports)) as executor:
+        return list(executor.map(save, reports))
+
+def generate_excel_files(parsed_data, report_type, year, months, temp_dir, output='disk'):
+    """Создание Excel файлов с отчетами (путь к файлу или книга в памяти)"""
+    report_type = report_type if report_type == 'free' else 'paid'
+    file_info = generate_reports(parsed_data, [report_type], year, months, temp_dir, output=output)[0]
+    return file_info.get('path') or file_info['workbook']
\ No newline at end of file
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+# Директория временных файлов пользовательских сессий
+TEMP_FILES_DIR = os.environ.get(
+    'TEMP_FILES_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp_files')
+)
+
+# Через сколько секунд после последнего обращения каталог сессии удаляется (по умолчанию 24 часа)
+TEMP_DIR_TTL = int(os.environ.get('TEMP_DIR_TTL', 86400))
+
+# Общий объем временных файлов в байтах (по умолчанию 1 ГБ)
+TEMP_QUOTA_BYTES = int(os.environ.get('TEMP_QUOTA_BYTES', 1024 * 1024 * 1024))
+
+# Период фоновой уборки в секундах (0 - только запуском из командной строки)
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 300))
+
+# Сколько каталогов удаляется за одну блокировку индекса
+JANITOR_BATCH = int(os.environ.get('JANITOR_BATCH', 50))
+
+# Каталоги, к которым обращались недавно, не удаляются даже при превышении квоты
+ACTIVE_GRACE = 3600
+
+_INDEX_NAME = '.janitor.json'
+
+_lock = threading.Lock()
+_index = None
+_needs_adoption = False
+_removed = set()
+_thread = None
+_stop = threading.Event()
+
+def _index_path():
+    return os.path.join(TEMP_FILES_DIR, _INDEX_NAME)
+
+def _read_index_file():
+    try:
+        with open(_index_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _load_index():
+    """Загрузка индекса каталогов (вызывается под блокировкой)"""
+    global _index, _needs_adoption
+    if _index is None:
+        _index = _read_index_file()
+        # Индекса еще нет - существующие каталоги добавляются при первой уборке
+        _needs_adoption = _index is None
+        _index = _index or {}
+    return _index
+
+def _save_index():
+    """Запись индекса с учетом обращений из других процессов (вызывается под блокировкой)"""
+    index = _load_index()
+    for name, entry in (_read_index_file() or {}).items():
+        if name in _removed:
+            continue
+        current = index.get(name)
+        if current is None:
+            index[name] = entry
+        elif entry['expires_at'] > current['expires_at']:
+            current['expires_at'] = entry['expires_at']
+            current['size'] = None
+    _removed.clear()
+    
+    os.makedirs(TEMP_FILES_DIR, exist_ok=True)
+    tmp_path = f"{_index_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, _index_path())
+
+def touch(name):
+    """Продление срока жизни каталога сессии"""
+    with _lock:
+        entry = _load_index().setdefault(name, {'expires_at': 0, 'size': None})
+        entry['expires_at'] = time.time() + TEMP_DIR_TTL
+        # Размер пересчитывается при следующей уборке
+        entry['size'] = None
+        
+        # Без фоновой уборки индекс сразу сохраняется для запуска из командной строки
+        if not (_thread and _thread.is_alive()):
+            try:
+                _save_index()
+            except OSError:
+                logger.exception("Не удалось сохранить индекс временных каталогов")
+
+def _adopt_existing():
+    """Добавление в индекс каталогов, созданных до его появления"""
+    adopted = {}
+    try:
+        for item in os.scandir(TEMP_FILES_DIR):
+            if item.is_dir(follow_symlinks=False):
+                adopted[item.name] = {'expires_at': item.stat().st_mtime + TEMP_DIR_TTL, 'size': None}
+    except OSError:
+        logger.exception("Не удалось прочитать каталог %s", TEMP_FILES_DIR)
+    return adopted
+
+def _dir_size(path):
+    """Объем файлов каталога или None, если каталога нет"""
+    if not os.path.isdir(path):
+        return None
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass
+    return total
+
+def _select_victims(index, now):
+    """Каталоги к удалению: устаревшие и самые старые сверх квоты"""
+    expired = [name for name, entry in index.items() if entry['expires_at'] <= now]
+    victims = set(expired)
+    
+    total = sum(entry['size'] or 0 for name, entry in index.items() if name not in victims)
+    active_after = now + TEMP_DIR_TTL - ACTIVE_GRACE
+    for name, entry in sorted(index.items(), key=lambda item: item[1]['expires_at']):
+        if total <= TEMP_QUOTA_BYTES:
+            break
+        if name in victims or entry['expires_at'] > active_after:
+            continue
+        victims.add(name)
+        total -= entry['size'] or 0
+    
+    return [(name, 'expired' if name in expired else 'quota', index[name]['expires_at'])
+            for name in sorted(victims, key=lambda name: index[name]['expires_at'])]
+
+def sweep(now=None):
+    """Один проход уборки, возвращает количество удаленных каталогов"""
+    global _needs_adoption
+    now = now or time.time()
+    with metrics.span('janitor_sweep'):
+        with _lock:
+            index = _load_index()
+            if _needs_adoption:
+                _needs_adoption = False
+                for name, entry in _adopt_existing().items():
+                    index.setdefault(name, entry)
+            unsized = [name for name, entry in index.items() if entry['size'] is None]
+        
+        # Размеры считаются вне блокировки, чтобы не задерживать запросы
+        sizes = {name: _dir_size(os.path.join(TEMP_FILES_DIR, name)) for name in unsized}
+        
+        with _lock:
+            for name, size in sizes.items():
+                entry = index.get(name)
+                if entry is None or entry['size'] is not None:
+                    continue
+                if size is None:
+                    # Каталог уже удален вручную или другим процессом
+                    index.pop(name)
+                    _removed.add(name)
+                else:
+                    entry['size'] = size
+            victims = _select_victims(index, now)
+        
+        removed = 0
+        for start in range(0, len(victims), JANITOR_BATCH):
+            batch = []
+            with _lock:
+                for name, reason, expires_at in victims[start:start + JANITOR_BATCH]:
+                    entry = index.get(name)
+                    # К каталогу могли обратиться после выбора
+                    if entry is None or entry['expires_at'] != expires_at:
+                        continue
+                    index.pop(name)
+                    _removed.add(name)
+                    batch.append((name, reason))
+            
+            for name, reason in batch:
+                shutil.rmtree(os.path.join(TEMP_FILES_DIR, name), ignore_errors=True)
+                metrics.increment('temp_dirs_removed', reason=reason)
+            removed += len(batch)
+        
+        with _lock:
+            try:
+                _save_index()
+            except OSError:
+                logger.exception("Не удалось сохранить индекс временных каталогов")
+    
+    if removed:
+        logger.info("Удалено временных каталогов: %s", removed)
+    return removed
+
+def _run(interval):
+    # Первая уборка сразу при запуске, затем каждые interval секунд
+    while True:
+        try:
+            sweep()
+        except Exception:
+            logger.exception("Ошибка фоновой уборки временных файлов")
+        if _stop.wait(interval):
+            break
+
+def start(interval=JANITOR_INTERVAL):
+    """Запуск фоновой уборки (повторный вызов ничего не делает)"""
+    global _thread
+    with _lock:
+        if interval <= 0 or (_thread and _thread.is_alive()):
+            return
+        _stop.clear()
+        _thread = threading.Thread(target=_run, args=(interval,), name='temp-janitor', daemon=True)
+        _thread.start()
+
+def stop():
+    """Остановка фоновой уборки"""
+    _stop.set()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Уборка временных файлов сессий")
+    arg_parser.add_argument('--loop', action='store_true', help="повторять уборку каждые JANITOR_INTERVAL секунд")
+    args = arg_parser.parse_args()
+    
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    if not args.loop:
+        print(f"Удалено каталогов: {sweep()}")
+    elif JANITOR_INTERVAL <= 0:
+        sys.exit("JANITOR_INTERVAL должен быть больше 0")
+    else:
+        _run(JANITOR_INTERVAL)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+# Количество отчетов, формируемых одновременно
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# Сколько секунд хранить информацию о завершенных задачах
+JOB_TTL = int(os.environ.get('JOB_TTL', 86400))
+
+# Сколько секунд хранить книги отчетов в памяти после завершения задачи
+MEMORY_RESULT_TTL = int(os.environ.get('MEMORY_RESULT_TTL', 900))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='report-job')
+_lock = threading.Lock()
+_jobs = {}
+# Выполняемые задачи по ключу объединения
+_inflight = {}
+
+def flight_key(kind, data):
+    """Ключ объединения одинаковых задач по виду задачи и нормализованным параметрам"""
+    return hashlib.sha256(json.dumps([kind, data], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def submit_job(owner, stages, func, *args, dedup_key=None, **kwargs):
+    """Постановка задачи в очередь, возвращает идентификатор задачи"""
+    # Задача с dedup_key незавершенной задачи не выполняется повторно, а разделяет ее этапы и результат
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'owner': owner,
+        'dedup_key': dedup_key,
+        'leader': None,
+        'status': 'queued',
+        'stages': {name: {'status': 'pending', 'elapsed': None} for name in stages},
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'result': None,
+        'error': None
+    }
+    with _lock:
+        _prune()
+        leader_id = _inflight.get(dedup_key) if dedup_key else None
+        if leader_id:
+            job['leader'] = leader_id
+        elif dedup_key:
+            _inflight[dedup_key] = job_id
+        _jobs[job_id] = job
+    
+    if leader_id:
+        metrics.increment('jobs_deduplicated')
+        logger.info("Задача %s присоединена к выполняемой задаче %s", job_id, leader_id)
+        return job_id
+    _executor.submit(_run_job, job_id, func, args, kwargs)
+    return job_id
+
+def get_job(job_id, owner=None):
+    """Снимок состояния задачи (None, если задачи нет или она чужая)"""
+    with _lock:
+        _prune()
+        job = _jobs.get(job_id)
+        if job is None or (owner is not None and job['owner'] != owner):
+            return None
+        # Присоединенная задача показывает состояние и результат выполняемой
+        source = _jobs.get(job['leader'], job) if job['leader'] else job
+        snapshot = dict(source, id=job['id'], owner=job['owner'], created_at=job['created_at'],
+                        leader=job['leader'])
+        snapshot['stages'] = {name: dict(info) for name, info in source['stages'].items()}
+    
+    # Прогресс - доля завершенных или пропущенных этапов
+    stages = snapshot['stages'].values()
+    done = sum(1 for info in stages if info['status'] in ('done', 'skipped'))
+    snapshot['progress'] = round(done / len(stages), 2) if stages else 0
+    return snapshot
+
+def _update(job_id, **fields):
+    with _lock:
+        _jobs[job_id].update(fields)
+
+def _stage_tracker(job_id):
+    """Контекстный менеджер для отметки начала и окончания этапа"""
+    @contextmanager
+    def stage(name):
+        started = time.perf_counter()
+        with _lock:
+            _jobs[job_id]['stages'].setdefault(name, {})['status'] = 'running'
+        status = 'error'
+        try:
+            yield
+            status = 'done'
+        finally:
+            with _lock:
+                _jobs[job_id]['stages'][name].update({
+                    'status': status,
+                    'elapsed': round(time.perf_counter() - started, 3)
+                })
+    return stage
+
+def _run_job(job_id, func, args, kwargs):
+    _update(job_id, status='running', started_at=time.time())
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        result = func(*args, stage=_stage_tracker(job_id), **kwargs)
+        with _lock:
+            # Этапы, которые не понадобились (например, отчет взят из кэша)
+            for info in _jobs[job_id]['stages'].values():
+                if info['status'] == 'pending':
+                    info['status'] = 'skipped'
+        _update(job_id, status='done', result=result, finished_at=time.time())
+        status = 'done'
+    except Exception as e:
+        logger.warning("Задача %s завершилась с ошибкой: %s", job_id, e)
+        _update(job_id, status='error', error=str(e), finished_at=time.time())
+    finally:
+        with _lock:
+            # Следующий такой же запрос уже запускает новую задачу
+            key = _jobs[job_id]['dedup_key']
+            if key and _inflight.get(key) == job_id:
+                del _inflight[key]
+        metrics.observe('job', time.perf_counter() - started, status=status)
+
+def _result_workbooks(job):
+    """Книги в памяти из результата задачи"""
+    if not isinstance(job['result'], list):
+        return []
+    return [file_info['workbook'] for file_info in job['result']
+            if isinstance(file_info, dict) and 'workbook' in file_info]
+
+def _prune():
+    """Удаление устаревших завершенных задач (вызывается под блокировкой)"""
+    now = time.time()
+    # Книги в памяти занимают память процесса, поэтому хранятся меньше остальных результатов
+    expired = {job_id for job_id, job in _jobs.items()
+               if job['finished_at'] and now - job['finished_at'] >
+               (MEMORY_RESULT_TTL if _result_workbooks(job) else JOB_TTL)}
+    # Присоединенные задачи удаляются вместе с выполненной
+    expired.update(job_id for job_id, job in _jobs.items()
+                   if job['leader'] and (job['leader'] in expired or job['leader'] not in _jobs))
+    for job_id in expired:
+        for workbook in _result_workbooks(_jobs.pop(job_id)):
+            workbook.close()
\ No newline at end of file
@@ -0,0 +1,142 @@
+import os
+import time
+import uuid
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Префикс имен метрик в текстовом формате Prometheus
+METRICS_PREFIX = 'rating'
+
+# Директория для файлов профилирования отчетов
+PROFILE_DIR = os.environ.get(
+    'PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'profiles')
+)
+
+_lock = threading.Lock()
+_counters = {}
+_spans = {}
+# Одновременно профилируется только один блок: в Python 3.12+ cProfile работает
+# через общий для процесса sys.monitoring, и второй профиль не запускается
+_profile_lock = threading.Lock()
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def increment(name, value=1, **labels):
+    """Увеличение счетчика с метками"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    """Учет длительности операции: количество, сумма и максимум"""
+    key = _key(name, labels)
+    with _lock:
+        span = _spans.setdefault(key, [0, 0.0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+        span[2] = max(span[2], seconds)
+
+@contextmanager
+def span(name, **labels):
+    """Замер длительности блока кода (учитывается и при ошибке)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed, **labels)
+        logger.debug("%s %s: %.3f с", name, labels or '', elapsed)
+
+def snapshot():
+    """Текущие значения метрик в виде словаря для JSON"""
+    with _lock:
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(_counters.items())]
+        spans = [{'name': name, 'labels': dict(labels), 'count': count,
+                  'seconds_total': round(total, 6), 'seconds_max': round(peak, 6)}
+                 for (name, labels), (count, total, peak) in sorted(_spans.items())]
+    return {'counters': counters, 'spans': spans}
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+def prometheus_text():
+    """Текущие значения метрик в текстовом формате Prometheus"""
+    with _lock:
+        counters = sorted(_counters.items())
+        spans = sorted(_spans.items())
+    
+    # Строки одной метрики должны идти подряд после ее объявления типа
+    families = {}
+    for (name, labels), value in counters:
+        metric = f"{METRICS_PREFIX}_{name}_total"
+        families.setdefault((metric, 'counter'), []).append(f"{metric}{_format_labels(labels)} {value}")
+    for (name, labels), (count, total, peak) in spans:
+        metric = f"{METRICS_PREFIX}_{name}_seconds"
+        families.setdefault((metric, 'summary'), []).extend([
+            f"{metric}_count{_format_labels(labels)} {count}",
+            f"{metric}_sum{_format_labels(labels)} {total:.6f}"
+        ])
+        families.setdefault((f"{metric}_max", 'gauge'), []).append(
+            f"{metric}_max{_format_labels(labels)} {peak:.6f}")
+    
+    lines = []
+    for (metric, kind), samples in families.items():
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Сброс всех метрик"""
+    with _lock:
+        _counters.clear()
+        _spans.clear()
+
+@contextmanager
+def profiled(name, enabled=True):
+    """Профилирование блока кода через cProfile с сохранением в PROFILE_DIR (в Python 3.12+ в профиль попадают все потоки процесса)"""
+    profile = _start_profile(name) if enabled else None
+    if profile is None:
+        yield None
+        return
+    
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof")
+    try:
+        yield path
+    finally:
+        # Ошибки профилировщика не должны прерывать профилируемый код
+        try:
+            profile.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile.dump_stats(path)
+            logger.info("Профиль сохранен: %s", path)
+        except Exception:
+            logger.exception("Не удалось сохранить профиль %s", path)
+        finally:
+            _profile_lock.release()
+
+def _start_profile(name):
+    """Запуск профиля или None, если уже работает другой профиль"""
+    if not _profile_lock.acquire(blocking=False):
+        logger.info("Профилирование %s пропущено: уже выполняется другое профилирование", name)
+        increment('profiles_skipped')
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Профилировщик процесса занят другим инструментом (отладчик, coverage)
+        _profile_lock.release()
+        logger.warning("Профилирование %s пропущено: активен другой инструмент профилирования", name)
+        increment('profiles_skipped')
+        return None
+    return profile
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import sqlite3
+from contextlib import closing
+from modules.ratings_matrix import RatingMatrix
+from modules.schema import NUMERIC_FIELDS, SQL_TYPES
+
+# Файл базы с историей разобранных данных по месяцам
+MONTH_STORE_PATH = os.environ.get(
+    'MONTH_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'months.sqlite3')
+)
+
+# Версия структуры базы; при изменении схемы полей сохраненные месяцы разбираются заново
+SCHEMA_VERSION = 2
+
+# Колонки числовых полей в порядке схемы
+_FIELD_COLUMNS = ', '.join(NUMERIC_FIELDS)
+_FLOAT_OFFSETS = [offset for offset, kind in enumerate(NUMERIC_FIELDS.values(), 2)
+                  if kind in ('float', 'percent')]
+_BOOL_OFFSETS = [offset for offset, kind in enumerate(NUMERIC_FIELDS.values(), 2) if kind == 'bool']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+    region TEXT NOT NULL,
+    city TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    closed INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (region, city, year, month)
+);
+CREATE TABLE IF NOT EXISTS ratings (
+    region TEXT NOT NULL,
+    city TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    partner_city TEXT NOT NULL,
+    {field_columns},
+    PRIMARY KEY (region, city, year, month, position)
+);
+CREATE INDEX IF NOT EXISTS ratings_partner ON ratings (name, year, month);
+CREATE INDEX IF NOT EXISTS ratings_partner_city ON ratings (region, partner_city);
+""".format(field_columns=',\n    '.join(f"{field} {SQL_TYPES[kind]}" for field, kind in NUMERIC_FIELDS.items()))
+
+def _connect():
+    os.makedirs(os.path.dirname(MONTH_STORE_PATH), exist_ok=True)
+    connection = sqlite3.connect(MONTH_STORE_PATH, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        connection.executescript("DROP TABLE IF EXISTS ratings; DROP TABLE IF EXISTS months;")
+        connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    connection.executescript(_SCHEMA)
+    return connection
+
+def _record(row):
+    """Запись из строки базы (NULL в дробных полях - отсутствующее значение, логические поля хранятся как 0/1)"""
+    record = list(row)
+    for offset in _FLOAT_OFFSETS:
+        if record[offset] is None:
+            record[offset] = math.nan
+    for offset in _BOOL_OFFSETS:
+        record[offset] = bool(record[offset])
+    return tuple(record)
+
+def _group_by_year(periods):
+    """Группировка периодов (год, месяц) по годам"""
+    years = {}
+    for year, month in periods:
+        years.setdefault(int(year), []).append(int(month))
+    return years
+
+def month_states(region, city, periods):
+    """Отпечатки сохраненных месяцев: {(год, месяц): {'fingerprint', 'closed'}}"""
+    states = {}
+    with closing(_connect()) as connection:
+        for year, months in _group_by_year(periods).items():
+            placeholders = ', '.join('?' * len(months))
+            rows = connection.execute(
+                f"SELECT month, fingerprint, closed FROM months "
+                f"WHERE region = ? AND city = ? AND year = ? AND month IN ({placeholders})",
+                (region, city, year, *months)
+            )
+            for month, fingerprint, closed in rows:
+                states[(year, month)] = {'fingerprint': fingerprint, 'closed': bool(closed)}
+    return states
+
+def load_months(region, city, periods):
+    """Записи (имя, город, числовые поля) сохраненных месяцев в исходном порядке"""
+    records = {}
+    with closing(_connect()) as connection:
+        for year, months in _group_by_year(periods).items():
+            placeholders = ', '.join('?' * len(months))
+            rows = connection.execute(
+                f"SELECT month, name, partner_city, {_FIELD_COLUMNS} FROM ratings "
+                f"WHERE region = ? AND city = ? AND year = ? AND month IN ({placeholders}) "
+                f"ORDER BY month, position",
+                (region, city, year, *months)
+            )
+            for month, *record in rows:
+                records.setdefault((year, month), []).append(_record(record))
+    return records
+
+def query_history(region, city, start, end, partners=None, partner_city=None):
+    """Данные за период [start, end] (кортежи (год, месяц)) в виде матрицы с отбором по партнерам и городу"""
+    (start_year, start_month), (end_year, end_month) = start, end
+    conditions = [
+        "region = ?", "city = ?",
+        "(year > ? OR (year = ? AND month >= ?))",
+        "(year < ? OR (year = ? AND month <= ?))"
+    ]
+    args = [region, city, start_year, start_year, start_month, end_year, end_year, end_month]
+    if partners is not None:
+        partners = list(partners)
+        conditions.append(f"name IN ({', '.join('?' * len(partners))})")
+        args.extend(partners)
+    if partner_city is not None:
+        conditions.append("partner_city = ?")
+        args.append(partner_city)
+    
+    with closing(_connect()) as connection:
+        periods = connection.execute(
+            "SELECT year, month FROM months WHERE region = ? AND city = ? "
+            "AND (year > ? OR (year = ? AND month >= ?)) AND (year < ? OR (year = ? AND month <= ?)) "
+            "ORDER BY year, month",
+            args[:8]
+        ).fetchall()
+        rows = connection.execute(
+            f"SELECT year, month, name, partner_city, {_FIELD_COLUMNS} FROM ratings "
+            f"WHERE {' AND '.join(conditions)} ORDER BY year, month, position",
+            args
+        )
+        records = {}
+        for year, month, *record in rows:
+            records.setdefault((year, month), []).append(_record(record))
+    
+    months = [{'key': f"{year}_{month:02d}", 'year': year, 'month': month} for year, month in periods]
+    return RatingMatrix.from_month_records(months, [records.get(period, []) for period in periods])
+
+def save_month(region, city, year, month, fingerprint, records, closed):
+    """Сохранение (замена) разобранных записей месяца"""
+    key = (region, city, int(year), int(month))
+    with closing(_connect()) as connection, connection:
+        connection.execute(
+            "DELETE FROM ratings WHERE region = ? AND city = ? AND year = ? AND month = ?", key)
+        connection.executemany(
+            f"INSERT INTO ratings VALUES ({', '.join('?' * (7 + len(NUMERIC_FIELDS)))})",
+            ((*key, position, *record) for position, record in enumerate(records))
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, fingerprint, int(closed), time.time())
+        )
+
+def mark_closed(region, city, year, month):
+    """Отметка, что данные месяца окончательные"""
+    with closing(_connect()) as connection, connection:
+        connection.execute(
+            "UPDATE months SET closed = 1 WHERE region = ? AND city = ? AND year = ? AND month = ?",
+            (region, city, int(year), int(month))
+        )
\ No newline at end of file
@@ -1,94 +1,142 @@
+import re
+import codecs
+import logging
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from modules.ratings_matrix import RatingMatrix
+from modules.partners import UNKNOWN_CITY
+from modules.schema import NUMERIC_FIELDS, FIELD_CONVERTERS
+from modules import metrics
 
-def parse_xml_data(xml_files):
-    """Парсинг данных из XML файлов"""
-    # Структура для хранения данных
-    parsed_data = {
-        'partners': {},
-        'months': []
-    }
+logger = logging.getLogger(__name__)
+
+# Поля партнера, которые извлекаются из выгрузки
+PARTNER_FIELDS = ('name', 'city', *NUMERIC_FIELDS)
+
+# Сколько байт из начала файла используется для определения кодировки
+_SNIFF_SIZE = 64 * 1024
+
+_DECLARATION_RE = re.compile(rb'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+def detect_encoding(head):
+    """Определение кодировки по BOM, XML-декларации или содержимому"""
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
     
-    # Сортируем файлы по месяцам
-    xml_files.sort(key=lambda x: (x['year'], x['month']))
+    match = _DECLARATION_RE.match(head)
+    encoding = match.group(1).decode('ascii').lower() if match else 'utf-8'
+    
+    # Выгрузки без декларации или с неверной декларацией бывают в cp1251
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+    except (LookupError, UnicodeDecodeError):
+        return 'cp1251'
+    return encoding
+
+def iter_partners(file_path, fields=PARTNER_FIELDS):
+    """Потоковое чтение партнеров из XML-файла за один проход"""
+    wanted = frozenset(fields)
     
-    for file_info in xml_files:
-        file_path = file_info['path']
-        year = file_info['year']
-        month = file_info['month']
-        month_key = f"{year}_{month:02d}"
+    with open(file_path, 'rb') as f:
+        encoding = detect_encoding(f.read(_SNIFF_SIZE))
+        f.seek(0)
         
-        # Добавляем месяц в список обработанных
-        parsed_data['months'].append({
-            'key': month_key,
-            'year': year,
-            'month': month
-        })
+        parser = ET.XMLParser(encoding=encoding)
+        depth = 0
+        root = None
+        record = None
         
-        try:
-            # Пробуем различные кодировки
-            for encoding in ['utf-8', 'cp1251', 'windows-1252', 'latin-1']:
-                try:
-                    # Читаем файл
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        xml_content = f.read()
-                    
-                    # Парсим XML
-                    root = ET.fromstring(xml_content)
-                    break
-                except:
-                    continue
-            else:
-                # Если не удалось распознать кодировку, пропускаем файл
+        for event, elem in ET.iterparse(f, events=('start', 'end'), parser=parser):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = elem
+                elif depth == 2 and elem.tag == 'partner':
+                    record = {}
+                continue
+            
+            depth -= 1
+            if record is None:
+                continue
+            
+            if depth == 2 and elem.tag in wanted:
+                # Берем первое вхождение поля, как делал find()
+                record.setdefault(elem.tag, elem.text)
+            elif depth == 1:
+                yield record
+                record = None
+                # Освобождаем уже обработанные элементы
+                root.clear()
+
+def parse_month_file(file_path):
+    """Разбор одного файла в список записей (имя, город, числовые поля схемы)"""
+    records = []
+    try:
+        for partner in iter_partners(file_path):
+            # Получаем имя
+            name = partner.get('name')
+            if name is None:
                 continue
-                
-            # Находим всех партнеров
-            partners = root.findall('./partner') or root.findall('partner')
             
-            # Обрабатываем каждого партнера
-            for partner in partners:
-                # Получаем имя
-                name_elem = partner.find('name')
-                if name_elem is None or name_elem.text is None:
-                    continue
-                
-                name = name_elem.text.strip()
-                
-                # Получаем город
-                city_elem = partner.find('city')
-                city = city_elem.text.strip() if city_elem is not None and city_elem.text else "Не указан"
-                
-                # Если это новый партнер, создаем запись
-                if name not in parsed_data['partners']:
-                    parsed_data['partners'][name] = {
-                        'name': name,
-                        'city': city,
-                        'free_data': {},
-                        'paid_data': {}
-                    }
-                
-                # Получаем данные о льготных подписках
-                free_amount = 0
-                free_elem = partner.find('free_amount')
-                if free_elem is not None and free_elem.text:
-                    try:
-                        free_amount = int(free_elem.text.strip())
-                    except ValueError:
-                        pass
-                
-                # Получаем данные о платных подписках
-                paid_amount = 0
-                paid_elem = partner.find('paid_amount')
-                if paid_elem is not None and paid_elem.text:
-                    try:
-                        paid_amount = int(paid_elem.text.strip())
-                    except ValueError:
-                        pass
-                
-                # Сохраняем данные
-                parsed_data['partners'][name]['free_data'][month_key] = free_amount
-                parsed_data['partners'][name]['paid_data'][month_key] = paid_amount
-                
-        except Exception:
-            continue
+            # Получаем город
+            city = partner.get('city')
+            city = city.strip() if city else UNKNOWN_CITY
+            
+            # Все числовые поля схемы приводятся к типам за один проход
+            records.append((
+                name.strip(),
+                city,
+                *(convert(partner.get(field)) for field, convert in FIELD_CONVERTERS)
+            ))
+    except (OSError, ET.ParseError, LookupError):
+        # Поврежденный или нечитаемый файл пропускаем целиком
+        return None
+    
+    return records
+
+def parse_month_records(xml_files, workers=None):
+    """Разбор файлов в список месяцев и записей по каждому месяцу"""
+    # Сортируем файлы по месяцам
+    xml_files.sort(key=lambda x: (x['year'], x['month']))
+    paths = [file_info['path'] for file_info in xml_files]
     
-    return parsed_data
\ No newline at end of file
+    if workers and workers > 1 and len(paths) > 1:
+        # Файлы независимы: разбираем их в пуле процессов и объединяем
+        # в исходном порядке, поэтому результат совпадает с последовательным
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+            month_records = list(executor.map(parse_month_file, paths))
+    else:
+        month_records = [parse_month_file(path) for path in paths]
+    
+    # Файлы разбираются и в дочерних процессах, поэтому счетчики обновляем здесь
+    for path, records in zip(paths, month_records):
+        if records is None:
+            logger.warning("Не удалось разобрать файл %s", path)
+            metrics.increment('parse_failures')
+        else:
+            metrics.increment('partners_parsed', len(records))
+    metrics.increment('files_parsed', len(paths))
+    
+    months = [{
+        'key': f"{file_info['year']}_{file_info['month']:02d}",
+        'year': file_info['year'],
+        'month': file_info['month']
+    } for file_info in xml_files]
+    
+    return months, month_records
+
+def parse_xml_matrix(xml_files, workers=None):
+    """Парсинг XML файлов в матрицы партнеры x месяцы"""
+    months, month_records = parse_month_records(xml_files, workers)
+    return RatingMatrix.from_month_records(months, month_records)
+
+def parse_xml_data(xml_files, workers=None):
+    """Парсинг данных из XML файлов"""
+    return parse_xml_matrix(xml_files, workers).to_dict()
\ No newline at end of file
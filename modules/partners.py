@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import numpy as np
+
+# Город партнера, если он не указан в выгрузке
+UNKNOWN_CITY = "Не указан"
+
+def partner_key(name, city):
+    """Постоянный идентификатор партнера для внешних систем: зависит только от имени и города"""
+    return hashlib.sha256(f"{name}\n{city}".encode('utf-8')).hexdigest()[:16]
+
+class Partner:
+    """Партнер из справочника: номер, имя и город"""
+    __slots__ = ('id', 'name', 'city')
+    
+    def __init__(self, partner_id, name, city):
+        self.id = partner_id
+        self.name = name
+        self.city = city
+    
+    def __repr__(self):
+        return f"Partner({self.id}, {self.name!r}, {self.city!r})"
+
+class PartnerRegistry:
+    """Справочник партнеров одного построения матрицы или пакета: имя и город определяют партнера и получают номер"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._strings = {}
+        self.partners = []
+    
+    def __len__(self):
+        return len(self.partners)
+    
+    def __getitem__(self, partner_id):
+        return self.partners[partner_id]
+    
+    def _add(self, name, city):
+        """Регистрация партнера (вызывается под блокировкой)"""
+        partner_id = self._ids.get((name, city))
+        if partner_id is None:
+            # Строки хранятся в одном экземпляре на все месяцы; справочник освобождается вместе с матрицами
+            name = self._strings.setdefault(name, name)
+            city = self._strings.setdefault(city, city)
+            partner_id = len(self.partners)
+            self.partners.append(Partner(partner_id, name, city))
+            self._ids[(name, city)] = partner_id
+        return partner_id
+    
+    def get_id(self, name, city):
+        """Номер партнера (новый партнер регистрируется)"""
+        partner_id = self._ids.get((name, city))
+        if partner_id is None:
+            with self._lock:
+                partner_id = self._add(name, city)
+        return partner_id
+    
+    def get_ids(self, names, cities):
+        """Номера партнеров для колонок имен и городов одного месяца"""
+        ids = [self._ids.get(key) for key in zip(names, cities)]
+        if None in ids:
+            with self._lock:
+                for pos, key in enumerate(zip(names, cities)):
+                    if ids[pos] is None:
+                        ids[pos] = self._add(*key)
+        return np.array(ids, dtype=np.int64)
\ No newline at end of file
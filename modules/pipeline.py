@@ -0,0 +1,332 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from modules.downloader import REGION, CITY, download_xml_files
+from modules.parser import parse_month_records
+from modules.ratings_matrix import RatingMatrix
+from modules.excel_generator import generate_reports
+from modules import month_store, report_cache, xml_cache, session_manager, snapshot, metrics
+
+# Этапы формирования отчета в порядке выполнения
+STAGES = ('download', 'parse', 'excel')
+
+class ReportError(Exception):
+    """Ошибка формирования отчета с сообщением для пользователя"""
+
+@contextmanager
+def no_stage(name):
+    """Этап без отметок о ходе выполнения"""
+    yield
+
+def timed_stages(stage):
+    """Этапы с учетом длительности в метриках"""
+    @contextmanager
+    def timed_stage(name):
+        with metrics.span('report_stage', stage=name), stage(name):
+            yield
+    return timed_stage
+
+def report_periods(params):
+    """Список периодов (год, месяц) отчета, в том числе за несколько лет"""
+    year = int(params['year'])
+    year_to = int(params.get('year_to') or year)
+    return [(report_year, int(month)) for report_year in range(year, year_to + 1)
+            for month in params['months']]
+
+def report_label(params):
+    """Год или диапазон лет для названий файлов"""
+    year = int(params['year'])
+    year_to = int(params.get('year_to') or year)
+    return str(year) if year_to == year else f"{year}-{year_to}"
+
+def periods_by_year(periods):
+    """Месяцы периодов (год, месяц) по годам"""
+    years = {}
+    for year, month in periods:
+        years.setdefault(year, []).append(month)
+    return years
+
+def check_credentials(params):
+    """Проверка учетных данных на сайте 1С до выдачи данных из кэшей и хранилища месяцев"""
+    if params.get('use_local_files'):
+        return
+    if not session_manager.get_session(params.get('username'), params.get('password')):
+        raise ReportError("Не удалось авторизоваться на сайте 1С. Проверьте правильность логина и пароля.")
+
+def stored_months(region, city, periods, incremental):
+    """Состояния сохраненных месяцев и периоды, которые можно взять из хранилища без загрузки"""
+    # Окончательные данные закрытых месяцев берем из хранилища без загрузки
+    states = month_store.month_states(region, city, periods) if incremental else {}
+    stored_periods = [period for period in periods if states.get(period, {}).get('closed')]
+    return states, stored_periods
+
+def month_digests(region, city, states, stored_periods, xml_files):
+    """Хэши данных по месяцам и файлы, которые нужно разобрать (неизменившиеся месяцы не разбираются)"""
+    digests = {period: states[period]['fingerprint'] for period in stored_periods}
+    files_to_parse = []
+    for file_info in xml_files:
+        year, month = period = (file_info['year'], file_info['month'])
+        digests[period] = report_cache.file_digest(file_info['path'])
+        state = states.get(period)
+        if state and state['fingerprint'] == digests[period]:
+            stored_periods.append(period)
+            if xml_cache.is_closed_month(year, month):
+                month_store.mark_closed(region, city, year, month)
+        else:
+            files_to_parse.append(file_info)
+    return digests, files_to_parse
+
+def load_month_records(region, city, stored_periods, files_to_parse, digests, incremental, parse_workers=0):
+    """Записи по месяцам: из снимков, из хранилища или разбором XML-файлов"""
+    # Снимки разобранных месяцев читаются вместо хранилища и XML-файлов
+    month_records = {}
+    for period in stored_periods:
+        columns = snapshot.load(digests[period])
+        if columns is not None:
+            month_records[period] = columns
+    
+    # Остальные сохраненные месяцы читаются из индексированного хранилища одним запросом на год
+    from_store = [period for period in stored_periods if period not in month_records]
+    if from_store:
+        month_records.update(month_store.load_months(region, city, from_store))
+    for period in stored_periods:
+        month_records.setdefault(period, [])
+    metrics.increment('months_from_store', len(from_store))
+    
+    xml_to_parse = []
+    for file_info in files_to_parse:
+        year, month = period = (file_info['year'], file_info['month'])
+        columns = snapshot.load(digests[period])
+        if columns is None:
+            xml_to_parse.append(file_info)
+            continue
+        # Такой же файл уже разбирался: берем снимок, хранилище обновляем по нему
+        month_records[period] = columns
+        if incremental:
+            month_store.save_month(region, city, year, month, digests[period], snapshot.to_records(columns),
+                                   closed=xml_cache.is_closed_month(year, month))
+    
+    parsed_months, parsed_records = parse_month_records(xml_to_parse, workers=parse_workers)
+    for month_info, records in zip(parsed_months, parsed_records):
+        year, month = period = (month_info['year'], month_info['month'])
+        month_records[period] = records
+        if records is not None:
+            snapshot.save(digests[period], records)
+            if incremental:
+                month_store.save_month(region, city, year, month, digests[period], records,
+                                       closed=xml_cache.is_closed_month(year, month))
+    return month_records
+
+def build_matrix(month_records, periods=None, cities=None, registry=None):
+    """Матрица партнеры x месяцы по записям за выбранные (по умолчанию все) периоды и города"""
+    # Разницы между месяцами пересчитываются из полного набора месяцев
+    report_months = sorted(period for period in (periods or month_records) if period in month_records)
+    return RatingMatrix.from_month_records(
+        [{'key': f"{year}_{month:02d}", 'year': year, 'month': month} for year, month in report_months],
+        [month_records[period] for period in report_months],
+        registry=registry,
+        cities=cities
+    )
+
+def _report_months(params, temp_dir, stage, download_workers, incremental):
+    """Загрузка недостающих месяцев отчета, возвращает источник данных для разбора"""
+    periods = report_periods(params)
+    region = params.get('region', REGION)
+    city = params.get('city', CITY)
+    use_local_files = params.get('use_local_files')
+    # Тестовые данные в хранилище месяцев не попадают
+    incremental = incremental and not use_local_files
+    
+    # Данные из общих кэшей выдаются только после авторизации
+    check_credentials(params)
+    states, stored_periods = stored_months(region, city, periods, incremental)
+    
+    # Получаем XML-файлы
+    with stage('download'):
+        xml_files = []
+        missing_periods = [period for period in periods if period not in stored_periods]
+        for year, months in periods_by_year(missing_periods).items():
+            if use_local_files:
+                xml_files.extend(create_test_xml_files(year, months, temp_dir))
+            else:
+                xml_files.extend(download_xml_files(year, months, temp_dir, params['username'], params['password'],
+                                                    max_workers=download_workers, region=region, city=city))
+    
+    # Проверяем, загрузились ли файлы
+    if not xml_files and not stored_periods:
+        raise ReportError("Не удалось загрузить XML файлы. Проверьте правильность учетных данных и подключение к интернету.")
+    
+    # Хэши данных по месяцам; неизменившиеся месяцы повторно не разбираем
+    digests, files_to_parse = month_digests(region, city, states, stored_periods, xml_files)
+    return {
+        'region': region,
+        'city': city,
+        'stored_periods': stored_periods,
+        'files_to_parse': files_to_parse,
+        'digests': digests,
+        'incremental': incremental
+    }
+
+def _parse_report_matrix(params, source, stage, parse_workers):
+    """Разбор месяцев отчета в матрицу партнеры x месяцы"""
+    with stage('parse'):
+        month_records = load_month_records(source['region'], source['city'], source['stored_periods'],
+                                           source['files_to_parse'], source['digests'], source['incremental'],
+                                           parse_workers)
+        parsed_data = build_matrix(month_records, cities=params.get('cities'))
+    
+    # Проверяем, что данные успешно извлечены
+    if not len(parsed_data) and params.get('cities'):
+        raise ReportError("В выбранных городах нет партнеров.")
+    if not len(parsed_data):
+        raise ReportError("Не удалось извлечь данные партнеров из XML файлов. Возможно, формат файлов изменился.")
+    return parsed_data
+
+@contextmanager
+def job_temp_dir(temp_dir, prefix='report_'):
+    """Отдельный каталог задачи в каталоге сессии: файлы одновременных задач не пересекаются"""
+    job_dir = tempfile.mkdtemp(prefix=prefix, dir=temp_dir)
+    try:
+        yield job_dir
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def load_report_matrix(params, temp_dir, stage=no_stage, download_workers=4, parse_workers=0, incremental=True):
+    """Загрузка и разбор данных отчета в матрицу без создания Excel-файлов"""
+    stage = timed_stages(stage)
+    with job_temp_dir(temp_dir) as job_dir:
+        source = _report_months(params, job_dir, stage, download_workers, incremental)
+        return _parse_report_matrix(params, source, stage, parse_workers)
+
+def run_report(params, temp_dir, stage=no_stage, download_workers=4, parse_workers=0, incremental=True,
+               output='disk'):
+    """Загрузка, разбор и создание Excel-файлов отчета (output='memory' - книги в памяти без кэша отчетов)"""
+    stage = timed_stages(stage)
+    # Каталог задачи удаляется после завершения: готовые файлы к этому моменту перенесены в кэш отчетов
+    with job_temp_dir(temp_dir) as job_dir:
+        return _build_report(params, job_dir, stage, download_workers, parse_workers, incremental, output)
+
+def _build_report(params, job_dir, stage, download_workers, parse_workers, incremental, output):
+    """Этапы отчета с файлами в каталоге задачи"""
+    source = _report_months(params, job_dir, stage, download_workers, incremental)
+    
+    # Такой же отчет по тем же данным уже мог быть сформирован
+    fingerprint = report_cache.data_fingerprint(
+        (year, month, digest) for (year, month), digest in source['digests'].items())
+    cache_key = report_cache.report_key(params, fingerprint)
+    cached_files = report_cache.lookup(cache_key)
+    metrics.increment('report_cache', result='hit' if cached_files else 'miss')
+    if cached_files:
+        return cached_files
+    
+    # Парсим данные
+    parsed_data = _parse_report_matrix(params, source, stage, parse_workers)
+    
+    # Генерируем Excel-файлы
+    with stage('excel'):
+        try:
+            # Все выбранные отчеты строятся за один проход по данным
+            excel_files = generate_reports(parsed_data, params['report_types'], report_label(params),
+                                           params['months'], job_dir,
+                                           combined=params.get('combined', False), output=output,
+                                           top_n=params.get('top_n'), min_change=params.get('min_change'))
+        except Exception as e:
+            raise ReportError(f"Произошла ошибка при создании Excel-файлов: {str(e)}")
+    
+    # Книги в памяти отдаются сразу и в кэш отчетов не попадают
+    if output == 'memory':
+        return excel_files
+    
+    # Проверяем, что файлы существуют
+    for file_info in excel_files:
+        if not os.path.exists(file_info['path']):
+            raise ReportError(f"Не удалось создать файл отчета: {file_info['name']}")
+    
+    # Сохраняем отчет для повторных запросов
+    return report_cache.store(cache_key, excel_files, job_dir)
+
+def create_test_xml_files(year, months, temp_dir):
+    """Создает тестовые XML файлы для указанного года и месяцев"""
+    sample_xml_content = """<?xml version="1.0" encoding="UTF-8"?>
+<partners>
+	<partner>
+		<place>1</place>
+		<region>Кыргызстан</region>
+		<city>Бишкек</city>
+		<name>1С-Като Экономикс</name>
+		<all_subs>2343 (+3.4%)</all_subs>
+		<all_amount>2343</all_amount>
+		<all_change>3.4</all_change>
+		<free_subs>18 (+5.88%)</free_subs>
+		<free_amount>18</free_amount>
+		<free_change>5.88</free_change>
+		<paid_subs>2325 (+3.38%)</paid_subs>
+		<paid_amount>2325</paid_amount>
+		<paid_change>3.38</paid_change>
+		<perf_subs>1</perf_subs>
+		<perf_amount>1</perf_amount>
+		<perf_change>0</perf_change>
+		<movement></movement>
+		<duo_subs>0</duo_subs>
+		<duo_amount>0</duo_amount>
+		<otchetnost>0</otchetnost>
+		<paid_drop>9.44%</paid_drop>
+		<free_drop>69.91%</free_drop>
+		<share>64.56%</share>
+		<share_change>-1.62%</share_change>
+		<status></status>
+		<in_order>Да</in_order>
+		<perf_ratio>Да</perf_ratio>
+	</partner>
+	<partner>
+		<place>2</place>
+		<region>Кыргызстан</region>
+		<city>Бишкек</city>
+		<name>ЛИСТ Кей Джи</name>
+		<all_subs>212 (+7.07%)</all_subs>
+		<all_amount>212</all_amount>
+		<all_change>7.07</all_change>
+		<free_subs>24 (-4%)</free_subs>
+		<free_amount>24</free_amount>
+		<free_change>-4</free_change>
+		<paid_subs>188 (+8.67%)</paid_subs>
+		<paid_amount>188</paid_amount>
+		<paid_change>8.67</paid_change>
+		<perf_subs>1</perf_subs>
+		<perf_amount>1</perf_amount>
+		<perf_change>0</perf_change>
+		<movement></movement>
+		<duo_subs>0</duo_subs>
+		<duo_amount>0</duo_amount>
+		<otchetnost>0</otchetnost>
+		<paid_drop></paid_drop>
+		<free_drop>15.85%</free_drop>
+		<share>5.84%</share>
+		<share_change>1.92%</share_change>
+		<status></status>
+		<in_order>Нет</in_order>
+		<perf_ratio>Да</perf_ratio>
+	</partner>
+</partners>"""
+    
+    # Создаем файлы для каждого месяца
+    test_files = []
+    for month in months:
+        filename = f"export_{year}_{month:02d}.xml"
+        file_path = os.path.join(temp_dir, filename)
+        
+        # Записываем содержимое в новый файл и подменяем им старый, не перезаписывая его на месте
+        part_path = f"{file_path}.part"
+        with open(part_path, 'w', encoding='utf-8') as f:
+            f.write(sample_xml_content)
+        os.replace(part_path, file_path)
+        
+        # Добавляем информацию о файле
+        test_files.append({
+            'path': file_path,
+            'year': int(year),
+            'month': month
+        })
+    
+    return test_files
\ No newline at end of file
@@ -0,0 +1,104 @@
+import io
+import csv
+import json
+import numpy as np
+from modules.partners import partner_key
+from modules.ratings_matrix import select_rows
+
+# Форматы выгрузки рейтинга и типы содержимого ответа
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8'
+}
+
+# Поле данных для каждого типа отчета
+REPORT_FIELDS = {
+    'free': 'free_amount',
+    'paid': 'paid_amount'
+}
+
+# Сколько строк партнер x месяц отдается одним блоком потока
+EXPORT_CHUNK_ROWS = 1000
+
+def export_columns(report_types):
+    """Поля данных и колонки выгрузки для выбранных типов отчетов"""
+    fields = [field for report_type, field in REPORT_FIELDS.items() if report_type in report_types]
+    columns = ['rank', 'partner_id', 'name', 'city', 'year', 'month', 'present']
+    for field in fields:
+        columns.extend((field, f"{field}_diff"))
+    return fields, columns
+
+def iter_ratings(matrix, report_types, top_n=None, min_change=None):
+    """Строки партнер x месяц со значениями и разницами с предыдущим месяцем, как в отчете Excel"""
+    fields, _ = export_columns(report_types)
+    if not fields or not len(matrix) or not matrix.months:
+        return
+    
+    order = sorted(range(len(matrix.months)),
+                   key=lambda col: (matrix.months[col]['year'], matrix.months[col]['month']))
+    months = [(matrix.months[col]['year'], matrix.months[col]['month']) for col in order]
+    values = {field: matrix.values[field][:, order].astype(np.int64) for field in fields}
+    diffs = {field: np.diff(field_values, axis=1) for field, field_values in values.items()}
+    present = matrix.present[:, order]
+    
+    # Партнеры отбираются и упорядочиваются по последнему месяцу первого выбранного типа отчета
+    ranking = values[fields[0]]
+    if top_n or min_change:
+        rows = select_rows(ranking, top_n, min_change)
+        rows = rows[np.argsort(-ranking[rows, -1], kind='stable')]
+    else:
+        rows = np.argsort(-ranking[:, -1], kind='stable')
+    
+    # Значения переводятся в списки Python блоками, а не целиком
+    partners_per_chunk = max(1, EXPORT_CHUNK_ROWS // len(months))
+    for start in range(0, len(rows), partners_per_chunk):
+        chunk = rows[start:start + partners_per_chunk]
+        chunk_values = {field: values[field][chunk].tolist() for field in fields}
+        chunk_diffs = {field: diffs[field][chunk].tolist() for field in fields}
+        chunk_present = present[chunk].tolist()
+        for pos, row in enumerate(chunk.tolist()):
+            # Номер из справочника процесса зависит от порядка загрузки, поэтому наружу отдается ключ имени и города
+            base = {
+                'rank': start + pos + 1,
+                'partner_id': partner_key(matrix.names[row], matrix.cities[row]),
+                'name': matrix.names[row],
+                'city': matrix.cities[row]
+            }
+            for col, (year, month) in enumerate(months):
+                record = dict(base, year=year, month=month, present=chunk_present[pos][col])
+                for field in fields:
+                    record[field] = chunk_values[field][pos][col]
+                    record[f"{field}_diff"] = chunk_diffs[field][pos][col - 1] if col else None
+                yield record
+
+def iter_ndjson(records):
+    """Блоки текста NDJSON: по одному объекту JSON в строке"""
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def iter_csv(records, columns):
+    """Блоки текста CSV с заголовком"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, lineterminator='\n')
+    writer.writeheader()
+    for count, record in enumerate(records, 1):
+        writer.writerow(record)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_ratings(matrix, report_types, export_format='ndjson', top_n=None, min_change=None):
+    """Поток блоков текста выгрузки рейтинга в формате ndjson или csv"""
+    _, columns = export_columns(report_types)
+    records = iter_ratings(matrix, report_types, top_n, min_change)
+    if export_format == 'csv':
+        return iter_csv(records, columns)
+    return iter_ndjson(records)
\ No newline at end of file
@@ -0,0 +1,188 @@
+import heapq
+import numpy as np
+from collections import Counter
+from modules.partners import PartnerRegistry, UNKNOWN_CITY
+from modules.schema import NUMERIC_FIELDS, DTYPES, empty_value
+
+# Поля, которые попадают в словарный вид, и соответствующие ключи
+DICT_FIELDS = {
+    'free_amount': 'free_data',
+    'paid_amount': 'paid_data'
+}
+
+def _record_columns(records):
+    """Колонки имен, городов и полей схемы из списка записей или из колонок снимка"""
+    if isinstance(records, dict):
+        return records['name'], records['city'], [records[field] for field in NUMERIC_FIELDS]
+    columns = list(zip(*records)) if records else [()] * (2 + len(NUMERIC_FIELDS))
+    return columns[0], columns[1], columns[2:]
+
+def _filter_cities(month_names, month_cities, field_columns, cities):
+    """Записи месяца только по выбранным городам (без учета регистра) и записи без города"""
+    keep = [pos for pos, city in enumerate(month_cities)
+            if city.casefold() in cities or city == UNKNOWN_CITY]
+    return ([month_names[pos] for pos in keep], [month_cities[pos] for pos in keep],
+            [np.asarray(column)[keep] for column in field_columns])
+
+def _resolve_unknown_cities(month_ids, registry):
+    """Замена номеров записей без города на номер партнера с тем же именем и известным городом.
+    Возвращает номера по месяцам и номера записей без города, которые не удалось отнести"""
+    unknown = {}
+    known = {}
+    for partner_id in np.unique(np.concatenate(month_ids)).tolist():
+        partner = registry[partner_id]
+        if partner.city == UNKNOWN_CITY:
+            unknown[partner.name] = partner_id
+        else:
+            known.setdefault(partner.name, []).append(partner_id)
+    
+    # Партнер определяется однозначно, только если в данных один город с таким именем
+    mapping = {partner_id: known[name][0] for name, partner_id in unknown.items()
+               if len(known.get(name, ())) == 1}
+    unresolved = np.array(sorted(set(unknown.values()) - mapping.keys()), dtype=np.int64)
+    if not mapping:
+        return month_ids, unresolved
+    
+    source = np.array(sorted(mapping), dtype=np.int64)
+    target = np.array([mapping[partner_id] for partner_id in source.tolist()], dtype=np.int64)
+    resolved = []
+    for ids in month_ids:
+        pos = np.minimum(np.searchsorted(source, ids), len(source) - 1)
+        hit = source[pos] == ids
+        resolved.append(np.where(hit, target[pos], ids))
+    return resolved, unresolved
+
+def select_rows(values, top_n=None, min_change=None):
+    """Строки матрицы значений с изменением за последний месяц не меньше min_change и top_n лучших по нему"""
+    rows = np.arange(len(values))
+    if min_change and values.shape[1] > 1:
+        rows = rows[np.abs(values[:, -1] - values[:, -2]) >= min_change]
+    if top_n and top_n < len(rows):
+        # Частичный отбор через кучу вместо сортировки всех партнеров
+        last_month = values[:, -1].tolist()
+        rows = np.array(heapq.nlargest(top_n, rows.tolist(), key=last_month.__getitem__), dtype=np.int64)
+    return rows
+
+def _empty_arrays(shape):
+    """Массивы всех числовых полей, заполненные значениями для отсутствующих данных"""
+    return {field: np.full(shape, empty_value(field), dtype=DTYPES[kind])
+            for field, kind in NUMERIC_FIELDS.items()}
+
+def _first_seen_rows(month_ids):
+    """Номера партнеров в порядке первого появления и строки матрицы для каждого месяца"""
+    if not month_ids:
+        return np.empty(0, dtype=np.int64), []
+    all_ids = np.concatenate(month_ids)
+    partner_ids, first_seen, inverse = np.unique(all_ids, return_index=True, return_inverse=True)
+    order = np.argsort(first_seen)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    bounds = np.cumsum([len(ids) for ids in month_ids])[:-1]
+    return partner_ids[order], np.split(rank[inverse], bounds)
+
+class RatingMatrix:
+    """Данные партнеров в виде матриц (партнеры x месяцы) по каждому полю"""
+    
+    def __init__(self, partner_ids, months, values, present, registry):
+        self.partner_ids = partner_ids
+        self.registry = registry
+        # Имена и города берутся из справочника, поэтому строки не дублируются между месяцами
+        partners = [registry[partner_id] for partner_id in partner_ids.tolist()]
+        self.names = [partner.name for partner in partners]
+        self.cities = [partner.city for partner in partners]
+        self.months = months
+        self.values = values
+        self.present = present
+        self.partner_index = {partner_id: idx for idx, partner_id in enumerate(partner_ids.tolist())}
+    
+    def __len__(self):
+        return len(self.names)
+    
+    @property
+    def month_keys(self):
+        return [month_info['key'] for month_info in self.months]
+    
+    @classmethod
+    def from_month_records(cls, months, month_records, registry=None, cities=None):
+        """Построение матрицы из записей (имя, город, поля схемы...) или колонок снимков по месяцам"""
+        # Без общего справочника номера партнеров действуют только внутри этой матрицы
+        if registry is None:
+            registry = PartnerRegistry()
+        cities = {city.strip().casefold() for city in cities} if cities else None
+        month_ids = []
+        month_fields = []
+        for records in month_records:
+            month_names, month_cities, field_columns = _record_columns(records or ())
+            # Отбор по городам до построения матрицы: остальные партнеры в нее не попадают
+            if cities is not None:
+                month_names, month_cities, field_columns = _filter_cities(
+                    month_names, month_cities, field_columns, cities)
+            # Партнер определяется именем и городом
+            month_ids.append(registry.get_ids(month_names, month_cities))
+            month_fields.append(field_columns)
+        
+        # Запись без города относится к партнеру с тем же именем из этих же данных
+        if month_ids:
+            month_ids, unresolved = _resolve_unknown_cities(month_ids, registry)
+            # Оставшиеся записи без города проходят отбор, только если выбран сам город "Не указан"
+            if cities is not None and UNKNOWN_CITY.casefold() not in cities and len(unresolved):
+                for pos, ids in enumerate(month_ids):
+                    keep = ~np.isin(ids, unresolved)
+                    month_ids[pos] = ids[keep]
+                    month_fields[pos] = [np.asarray(column)[keep] for column in month_fields[pos]]
+        partner_ids, month_rows = _first_seen_rows(month_ids)
+        
+        shape = (len(partner_ids), len(months))
+        values = _empty_arrays(shape)
+        present = np.zeros(shape, dtype=bool)
+        
+        for col, (rows, field_columns) in enumerate(zip(month_rows, month_fields)):
+            if not len(rows):
+                continue
+            present[rows, col] = True
+            # Колонка месяца заполняется для каждого поля одним присваиванием
+            for field, column in zip(NUMERIC_FIELDS, field_columns):
+                values[field][rows, col] = column
+        
+        return cls(partner_ids, list(months), values, present, registry)
+    
+    @classmethod
+    def from_dict(cls, parsed_data, registry=None):
+        """Построение матрицы из словарного вида {'partners', 'months'}"""
+        if registry is None:
+            registry = PartnerRegistry()
+        months = list(parsed_data['months'])
+        columns = {month_info['key']: col for col, month_info in enumerate(months)}
+        partners = parsed_data['partners']
+        
+        shape = (len(partners), len(months))
+        values = _empty_arrays(shape)
+        present = np.zeros(shape, dtype=bool)
+        
+        for row, partner in enumerate(partners.values()):
+            for field, data_key in DICT_FIELDS.items():
+                for key, value in partner[data_key].items():
+                    col = columns.get(key)
+                    if col is not None:
+                        values[field][row, col] = value
+                        present[row, col] = True
+        
+        partner_ids = registry.get_ids([partner['name'] for partner in partners.values()],
+                                       [partner['city'] for partner in partners.values()])
+        return cls(partner_ids, months, values, present, registry)
+    
+    def to_dict(self):
+        """Словарный вид {'partners', 'months'}, как у parse_xml_data"""
+        month_keys = self.month_keys
+        # Одноименные партнеры из разных городов различаются городом в ключе
+        name_counts = Counter(self.names)
+        partners = {}
+        for idx, name in enumerate(self.names):
+            city = self.cities[idx]
+            partner = {'name': name, 'city': city}
+            cols = np.flatnonzero(self.present[idx])
+            for field, data_key in DICT_FIELDS.items():
+                row = self.values[field][idx]
+                partner[data_key] = {month_keys[col]: int(row[col]) for col in cols}
+            partners[name if name_counts[name] == 1 else f"{name} ({city})"] = partner
+        return {'partners': partners, 'months': [dict(month_info) for month_info in self.months]}
\ No newline at end of file
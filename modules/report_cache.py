@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+# Директория кэша готовых отчетов
+REPORT_CACHE_DIR = os.environ.get(
+    'REPORT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'reports')
+)
+
+# Максимальный объем кэша отчетов в байтах (по умолчанию 256 МБ)
+REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+_lock = threading.Lock()
+_index = None
+
+def file_digest(path):
+    """Хэш содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def data_fingerprint(month_digests):
+    """Общий хэш исходных данных по хэшам месяцев [(год, месяц, хэш)]"""
+    digest = hashlib.sha256()
+    for year, month, month_digest in sorted(month_digests):
+        digest.update(f"{int(year)}-{int(month):02d}:{month_digest};".encode('ascii'))
+    return digest.hexdigest()
+
+def report_key(params, fingerprint):
+    """Ключ отчета по параметрам запроса и хэшу данных"""
+    key_data = {
+        'region': params.get('region'),
+        'city': params.get('city'),
+        'year': int(params['year']),
+        'year_to': int(params.get('year_to') or params['year']),
+        'months': sorted(params['months']),
+        'report_types': sorted(params['report_types']),
+        'combined': bool(params.get('combined')),
+        'top_n': params.get('top_n'),
+        'cities': sorted(params.get('cities') or []),
+        'min_change': params.get('min_change'),
+        'fingerprint': fingerprint
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _index_path():
+    return os.path.join(REPORT_CACHE_DIR, 'index.json')
+
+def _load_index():
+    """Загрузка индекса кэша (вызывается под блокировкой)"""
+    global _index
+    if _index is None:
+        try:
+            with open(_index_path(), 'r', encoding='utf-8') as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+def _save_index():
+    """Атомарная запись индекса кэша (вызывается под блокировкой)"""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{_index_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_index, f, ensure_ascii=False)
+    os.replace(tmp_path, _index_path())
+
+def lookup(key):
+    """Готовые файлы отчета из кэша или None"""
+    with _lock:
+        entry = _load_index().get(key)
+        if not entry:
+            return None
+        if not all(os.path.exists(file_info['path']) for file_info in entry['files']):
+            _remove(key)
+            _save_index()
+            return None
+        entry['last_access'] = time.time()
+        _save_index()
+        return [dict(file_info) for file_info in entry['files']]
+
+def store(key, excel_files, source_dir):
+    """Перенос готовых файлов отчета из каталога задачи source_dir в кэш, возвращает новые пути"""
+    # В кэш под ключом отчета попадают только файлы, созданные этой задачей
+    source_dir = os.path.realpath(source_dir)
+    for file_info in excel_files:
+        if os.path.dirname(os.path.realpath(file_info['path'])) != source_dir:
+            raise ValueError(f"Файл {file_info['path']} создан не в каталоге задачи {source_dir}")
+    
+    report_dir = os.path.join(REPORT_CACHE_DIR, key)
+    os.makedirs(report_dir, exist_ok=True)
+    
+    cached_files = []
+    size = 0
+    for file_info in excel_files:
+        path = os.path.join(report_dir, os.path.basename(file_info['path']))
+        shutil.move(file_info['path'], path)
+        size += os.path.getsize(path)
+        cached_files.append({'name': file_info['name'], 'path': path})
+    
+    with _lock:
+        _load_index()[key] = {
+            'files': cached_files,
+            'size': size,
+            'last_access': time.time()
+        }
+        _evict(keep=key)
+        _save_index()
+    return [dict(file_info) for file_info in cached_files]
+
+def _remove(key):
+    """Удаление отчета из кэша (вызывается под блокировкой)"""
+    _index.pop(key, None)
+    shutil.rmtree(os.path.join(REPORT_CACHE_DIR, key), ignore_errors=True)
+
+def _evict(keep):
+    """Вытеснение давно не запрашиваемых отчетов сверх лимита (вызывается под блокировкой)"""
+    index = _load_index()
+    total = sum(entry['size'] for entry in index.values())
+    for key, entry in sorted(index.items(), key=lambda item: item[1]['last_access']):
+        if total <= REPORT_CACHE_MAX_BYTES:
+            break
+        if key == keep:
+            continue
+        total -= entry['size']
+        _remove(key)
\ No newline at end of file
@@ -0,0 +1,59 @@
+import math
+import numpy as np
+
+# Числовые поля выгрузки рейтинга и их типы в порядке хранения:
+#   int     - целое число (пусто -> 0)
+#   float   - дробное число (пусто -> NaN)
+#   percent - строка вида "64.56%" (пусто -> NaN)
+#   bool    - "Да"/"Нет"
+NUMERIC_FIELDS = {
+    'place': 'int',
+    'all_amount': 'int',
+    'all_change': 'float',
+    'free_amount': 'int',
+    'free_change': 'float',
+    'paid_amount': 'int',
+    'paid_change': 'float',
+    'perf_amount': 'int',
+    'perf_change': 'float',
+    'duo_amount': 'int',
+    'otchetnost': 'int',
+    'paid_drop': 'percent',
+    'free_drop': 'percent',
+    'share': 'percent',
+    'share_change': 'percent',
+    'in_order': 'bool',
+    'perf_ratio': 'bool'
+}
+
+# Тип массива в матрице и тип колонки в базе для каждого вида поля
+DTYPES = {'int': np.int32, 'float': np.float64, 'percent': np.float64, 'bool': np.bool_}
+SQL_TYPES = {'int': 'INTEGER', 'float': 'REAL', 'percent': 'REAL', 'bool': 'INTEGER'}
+
+def _to_int(text):
+    if text:
+        try:
+            return int(text.strip())
+        except ValueError:
+            pass
+    return 0
+
+def _to_float(text):
+    if text:
+        try:
+            return float(text.strip().rstrip('%').replace(',', '.'))
+        except ValueError:
+            pass
+    return math.nan
+
+def _to_bool(text):
+    return bool(text) and text.strip().lower() == 'да'
+
+CONVERTERS = {'int': _to_int, 'float': _to_float, 'percent': _to_float, 'bool': _to_bool}
+
+# Конвертеры в порядке полей, чтобы не искать их для каждой записи
+FIELD_CONVERTERS = tuple((name, CONVERTERS[kind]) for name, kind in NUMERIC_FIELDS.items())
+
+def empty_value(field):
+    """Значение поля для месяца, в котором партнера нет"""
+    return CONVERTERS[NUMERIC_FIELDS[field]](None)
@@ -0,0 +1,212 @@
+import os
+import hmac
+import json
+import hashlib
+import threading
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
+from bs4 import BeautifulSoup
+from modules import metrics
+
+logger = logging.getLogger(__name__)
+
+# Директория для сохранения cookies авторизованных сессий
+SESSIONS_DIR = os.environ.get(
+    'SESSIONS_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'sessions')
+)
+
+# Сколько секунд доверяем сессии без повторной авторизации
+SESSION_MAX_AGE = int(os.environ.get('SESSION_MAX_AGE', 8 * 3600))
+
+# Размер пула соединений общей сессии (на все параллельные загрузки)
+SESSION_POOL_SIZE = int(os.environ.get('SESSION_POOL_SIZE', 16))
+
+# Ключ для хэширования учетных данных
+_SECRET = os.environ.get('SECRET_KEY', 'default_secret_key').encode('utf-8')
+
+_lock = threading.Lock()
+_sessions = {}
+_key_locks = {}
+
+def _new_session(pool_size=SESSION_POOL_SIZE):
+    """Создание сессии с общим пулом соединений"""
+    session = requests.Session()
+    
+    # Общий пул соединений, рассчитанный на параллельные загрузки
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    
+    # Базовые заголовки для всех запросов
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    session.headers.update(headers)
+    return session
+
+def login_to_1c(username, password, pool_size=SESSION_POOL_SIZE):
+    """Авторизация на сайте 1С"""
+    with metrics.span('login'):
+        session = _login(username, password, pool_size)
+    metrics.increment('logins', result='ok' if session else 'failed')
+    return session
+
+def _login(username, password, pool_size):
+    login_url = "https://login.1c.ru/login?service=https%3A%2F%2Fits.1c.eu%2Flogin%2F%3Faction%3Daftercheck%26provider%3Dlogin"
+    session = _new_session(pool_size)
+    
+    try:
+        # Получаем страницу авторизации
+        response = session.get(login_url)
+        soup = BeautifulSoup(response.text, 'html.parser')
+        
+        # Находим форму и скрытые поля
+        login_form = soup.find('form', {'id': 'loginForm'}) or soup.find('form')
+        if not login_form:
+            logger.warning("Форма авторизации не найдена на странице %s", response.url)
+            return None
+        
+        # Получаем скрытые поля
+        hidden_fields = {}
+        for field in login_form.find_all('input', {'type': 'hidden'}):
+            name = field.get('name')
+            if name:
+                hidden_fields[name] = field.get('value', '')
+        
+        # URL для отправки формы
+        form_action = login_form.get('action', '')
+        if form_action.startswith('/'):
+            submit_url = f"https://login.1c.ru{form_action}"
+        else:
+            submit_url = form_action or login_url
+        
+        # Данные для авторизации
+        form_data = {
+            'username': username,
+            'password': password,
+            **hidden_fields
+        }
+        
+        # Отправляем форму
+        login_response = session.post(
+            submit_url, 
+            data=form_data,
+            headers={'Referer': login_url},
+            allow_redirects=True
+        )
+        
+        # Проверяем успешность авторизации
+        if 'its.1c.eu' in login_response.url:
+            return session
+        logger.warning("Авторизация на сайте 1С не удалась для пользователя %s", username)
+    except Exception:
+        logger.exception("Ошибка при авторизации на сайте 1С")
+    
+    return None
+
+def credentials_hash(username, password):
+    """Хэш учетных данных, под которым хранится сессия"""
+    message = f"{username}\0{password}".encode('utf-8')
+    return hmac.new(_SECRET, message, hashlib.sha256).hexdigest()
+
+def _key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def _cookies_path(key):
+    return os.path.join(SESSIONS_DIR, f"{key}.json")
+
+def _save_cookies(key, session):
+    """Сохранение cookies сессии на диск"""
+    try:
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        path = _cookies_path(key)
+        tmp_path = f"{path}.tmp"
+        # Cookies хранятся в JSON: из файла читаются только данные, а не объекты Python
+        cookies = [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+                    'secure': cookie.secure, 'expires': cookie.expires}
+                   for cookie in session.cookies]
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cookies, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        logger.exception("Не удалось сохранить cookies сессии")
+
+def _load_session(key):
+    """Восстановление сессии из сохраненных cookies, если они не устарели"""
+    path = _cookies_path(key)
+    try:
+        created_at = os.path.getmtime(path)
+        if time.time() - created_at >= SESSION_MAX_AGE:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            cookies = [create_cookie(cookie['name'], cookie['value'], domain=cookie['domain'],
+                                     path=cookie['path'], secure=cookie['secure'], expires=cookie['expires'])
+                       for cookie in json.load(f)]
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("Не удалось прочитать сохраненные cookies сессии")
+        return None
+    
+    session = _new_session()
+    for cookie in cookies:
+        session.cookies.set_cookie(cookie)
+    return {'session': session, 'created_at': created_at}
+
+def _drop_cookies(key):
+    try:
+        os.remove(_cookies_path(key))
+    except OSError:
+        pass
+
+def get_session(username, password):
+    """Получение общей авторизованной сессии для учетных данных"""
+    key = credentials_hash(username, password)
+    with _key_lock(key):
+        entry = _sessions.get(key)
+        if entry and time.time() - entry['created_at'] < SESSION_MAX_AGE:
+            metrics.increment('sessions', source='memory')
+            return entry['session']
+        
+        entry = _load_session(key)
+        metrics.increment('sessions', source='cookies' if entry else 'login')
+        if entry is None:
+            session = login_to_1c(username, password)
+            if not session:
+                return None
+            entry = {'session': session, 'created_at': time.time()}
+            _save_cookies(key, session)
+        
+        _sessions[key] = entry
+        return entry['session']
+
+def relogin(username, password, stale_session):
+    """Повторная авторизация после того, как сессия истекла на сервере"""
+    key = credentials_hash(username, password)
+    with _key_lock(key):
+        entry = _sessions.get(key)
+        # Другой поток уже обновил сессию
+        if entry and entry['session'] is not stale_session:
+            return entry['session']
+        
+        _sessions.pop(key, None)
+        _drop_cookies(key)
+        
+        session = login_to_1c(username, password)
+        if not session:
+            return None
+        _sessions[key] = {'session': session, 'created_at': time.time()}
+        _save_cookies(key, session)
+        return session
+
+def is_login_redirect(response):
+    """Проверка, что вместо данных сервер перенаправил на страницу входа"""
+    if 'login.1c.ru' in response.url:
+        return True
+    return any('login.1c.ru' in r.headers.get('Location', '') for r in response.history)
\ No newline at end of file
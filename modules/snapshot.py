@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+from modules import metrics
+from modules.schema import NUMERIC_FIELDS, DTYPES
+
+logger = logging.getLogger(__name__)
+
+# Директория снимков разобранных месяцев
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'snapshots')
+)
+
+# Максимальный объем снимков в байтах (по умолчанию 256 МБ)
+SNAPSHOT_MAX_BYTES = int(os.environ.get('SNAPSHOT_MAX_BYTES', 256 * 1024 * 1024))
+
+# Снимки привязаны к составу полей схемы: при его изменении старые снимки не читаются
+_SCHEMA_TAG = hashlib.sha256(json.dumps(list(NUMERIC_FIELDS.items())).encode('utf-8')).hexdigest()[:8]
+
+def _snapshot_path(digest):
+    return os.path.join(SNAPSHOT_DIR, f"{digest}.{_SCHEMA_TAG}.npz")
+
+def _pack_strings(strings):
+    """Таблица строк: строки UTF-8 через нулевой символ (в XML он невозможен) и их количество"""
+    blob = '\0'.join(strings).encode('utf-8')
+    return np.frombuffer(blob, dtype=np.uint8), np.array(len(strings), dtype=np.int64)
+
+def _unpack_strings(blob, count):
+    # Таблица разбирается одним декодированием, без обработки строк по одной
+    return blob.tobytes().decode('utf-8').split('\0') if int(count) else []
+
+def save(digest, records):
+    """Запись снимка месяца по хэшу XML-файла из записей (имя, город, поля схемы)"""
+    columns = list(zip(*records)) if records else [()] * (2 + len(NUMERIC_FIELDS))
+    
+    # Города повторяются, поэтому хранятся справочником и кодами
+    city_table = sorted(set(columns[1]))
+    city_codes = {city: code for code, city in enumerate(city_table)}
+    arrays = {'city_codes': np.array([city_codes[city] for city in columns[1]], dtype=np.int32)}
+    arrays['name_blob'], arrays['name_count'] = _pack_strings(columns[0])
+    arrays['city_blob'], arrays['city_count'] = _pack_strings(city_table)
+    for (field, kind), column in zip(NUMERIC_FIELDS.items(), columns[2:]):
+        arrays[f"field_{field}"] = np.array(column, dtype=DTYPES[kind])
+    
+    path = _snapshot_path(digest)
+    # Имя временного файла уникально для процесса и потока: один месяц могут сохранять параллельные задачи
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.exception("Не удалось сохранить снимок месяца %s", digest)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    _evict()
+
+def load(digest):
+    """Колонки снимка месяца {'name', 'city', поля схемы} или None, если снимка нет"""
+    path = _snapshot_path(digest)
+    try:
+        with np.load(path) as data:
+            cities = _unpack_strings(data['city_blob'], data['city_count'])
+            columns = {
+                'name': _unpack_strings(data['name_blob'], data['name_count']),
+                'city': [cities[code] for code in data['city_codes'].tolist()]
+            }
+            for field in NUMERIC_FIELDS:
+                columns[field] = data[f"field_{field}"]
+        # Время изменения используется как время последнего обращения при вытеснении
+        os.utime(path)
+    except FileNotFoundError:
+        metrics.increment('snapshots', result='miss')
+        return None
+    except Exception:
+        logger.exception("Не удалось прочитать снимок месяца %s", digest)
+        metrics.increment('snapshots', result='error')
+        return None
+    metrics.increment('snapshots', result='hit')
+    return columns
+
+def to_records(columns):
+    """Записи (имя, город, поля схемы) из колонок снимка"""
+    return list(zip(columns['name'], columns['city'], *(columns[field].tolist() for field in NUMERIC_FIELDS)))
+
+def _evict():
+    """Удаление давно не использованных снимков сверх лимита"""
+    try:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(SNAPSHOT_DIR) if entry.name.endswith('.npz')]
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= SNAPSHOT_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
\ No newline at end of file
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import date
+
+# Директория общего кэша загруженных XML-файлов
+CACHE_DIR = os.environ.get(
+    'XML_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'xml')
+)
+
+# Максимальный объем кэша в байтах (по умолчанию 512 МБ)
+CACHE_MAX_BYTES = int(os.environ.get('XML_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Через сколько секунд данные незакрытого месяца нужно перепроверить на сервере
+OPEN_MONTH_TTL = int(os.environ.get('XML_CACHE_TTL', 3600))
+
+# Сколько дней после окончания месяца рейтинг еще может уточняться
+CLOSED_MONTH_GRACE_DAYS = 10
+
+_lock = threading.Lock()
+_index = None
+
+def cache_key(region, city, year, month):
+    """Ключ кэша для региона, города и месяца"""
+    return f"{region}|{city}|{int(year):04d}-{int(month):02d}"
+
+def is_closed_month(year, month, today=None):
+    """Проверка, что месяц закрыт и его рейтинг больше не меняется"""
+    today = today or date.today()
+    year, month = int(year), int(month)
+    # Первый день следующего после отчетного месяца
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    month_end = date(next_year, next_month, 1)
+    return (today - month_end).days >= CLOSED_MONTH_GRACE_DAYS
+
+def _index_path():
+    return os.path.join(CACHE_DIR, 'index.json')
+
+def _blob_path(digest):
+    return os.path.join(CACHE_DIR, 'blobs', f"{digest}.xml")
+
+def _load_index():
+    """Загрузка индекса кэша (вызывается под блокировкой)"""
+    global _index
+    if _index is None:
+        try:
+            with open(_index_path(), 'r', encoding='utf-8') as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+def _save_index():
+    """Атомарная запись индекса кэша (вызывается под блокировкой)"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{_index_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_index, f, ensure_ascii=False)
+    os.replace(tmp_path, _index_path())
+
+def lookup(key):
+    """Получение записи кэша, если файл на месте"""
+    with _lock:
+        entry = _load_index().get(key)
+        if entry and os.path.exists(_blob_path(entry['sha256'])):
+            return dict(entry)
+    return None
+
+def is_fresh(entry, year, month):
+    """Можно ли использовать запись без обращения к серверу"""
+    if is_closed_month(year, month):
+        return True
+    return time.time() - entry['fetched_at'] < OPEN_MONTH_TTL
+
+def revalidation_headers(entry):
+    """Заголовки условного запроса для перепроверки записи"""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def store_file(key, path, digest, etag=None, last_modified=None):
+    """Перенос уже загруженного файла с известным хэшем в кэш, возвращает обновленную запись"""
+    blob_path = _blob_path(digest)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    size = os.path.getsize(path)
+    
+    # Одинаковое содержимое хранится в одном экземпляре
+    if os.path.exists(blob_path):
+        os.remove(path)
+    else:
+        # Файл сначала копируется рядом с кэшем, если он на другом диске
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        shutil.move(path, tmp_path)
+        os.replace(tmp_path, blob_path)
+    
+    now = time.time()
+    entry = {
+        'sha256': digest,
+        'size': size,
+        'etag': etag,
+        'last_modified': last_modified,
+        'fetched_at': now,
+        'last_access': now
+    }
+    with _lock:
+        _load_index()[key] = entry
+        _evict()
+        _save_index()
+    return dict(entry)
+
+def mark_revalidated(key):
+    """Отметка о том, что сервер подтвердил актуальность записи (304)"""
+    with _lock:
+        entry = _load_index().get(key)
+        if entry:
+            entry['fetched_at'] = entry['last_access'] = time.time()
+            _save_index()
+
+def materialize(entry, dest_path):
+    """Размещение закэшированного файла по указанному пути"""
+    blob_path = _blob_path(entry['sha256'])
+    # Копия, а не жесткая ссылка: запись в файл сессии не должна менять файл в кэше
+    part_path = f"{dest_path}.{threading.get_ident()}.part"
+    shutil.copyfile(blob_path, part_path)
+    os.replace(part_path, dest_path)
+    with _lock:
+        index = _load_index()
+        for cached in index.values():
+            if cached['sha256'] == entry['sha256']:
+                cached['last_access'] = time.time()
+        _save_index()
+    return dest_path
+
+def _evict():
+    """Вытеснение давно не используемых записей сверх лимита (вызывается под блокировкой)"""
+    index = _load_index()
+    blob_sizes = {entry['sha256']: entry['size'] for entry in index.values()}
+    total = sum(blob_sizes.values())
+    if total <= CACHE_MAX_BYTES:
+        return
+    
+    for key, entry in sorted(index.items(), key=lambda item: item[1]['last_access']):
+        if total <= CACHE_MAX_BYTES:
+            break
+        del index[key]
+        digest = entry['sha256']
+        # Файл удаляется, только если на него больше не ссылается ни один ключ
+        if not any(other['sha256'] == digest for other in index.values()):
+            total -= blob_sizes[digest]
+            try:
+                os.remove(_blob_path(digest))
+            except OSError:
+                pass
\ No newline at end of file
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Приложение в тестах не трогает каталог temp_files проекта и не запускает фоновую уборку
+os.environ.setdefault('TEMP_FILES_DIR', tempfile.mkdtemp(prefix='rating-tests-'))
+os.environ.setdefault('JANITOR_INTERVAL', '0')
+
+from modules import month_store, report_cache, session_manager, snapshot, xml_cache
+
+# Учетные данные, которые принимает поддельная авторизация
+GOOD_USER = ('user', 'secret')
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    """Кэши, хранилище месяцев и сессии во временном каталоге теста"""
+    monkeypatch.setattr(xml_cache, 'CACHE_DIR', str(tmp_path / 'xml'))
+    monkeypatch.setattr(xml_cache, '_index', None)
+    monkeypatch.setattr(report_cache, 'REPORT_CACHE_DIR', str(tmp_path / 'reports'))
+    monkeypatch.setattr(report_cache, '_index', None)
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(month_store, 'MONTH_STORE_PATH', str(tmp_path / 'months.sqlite3'))
+    monkeypatch.setattr(session_manager, 'SESSIONS_DIR', str(tmp_path / 'sessions'))
+    monkeypatch.setattr(session_manager, '_sessions', {})
+    return tmp_path
+
+@pytest.fixture
+def fake_login(monkeypatch):
+    """Авторизация без сайта 1С: принимаются только GOOD_USER, попытки записываются"""
+    attempts = []
+    
+    def login_to_1c(username, password, pool_size=session_manager.SESSION_POOL_SIZE):
+        attempts.append(username)
+        if (username, password) != GOOD_USER:
+            return None
+        return session_manager._new_session(pool_size)
+    
+    monkeypatch.setattr(session_manager, 'login_to_1c', login_to_1c)
+    return attempts
\ No newline at end of file
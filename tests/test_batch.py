@@ -0,0 +1,29 @@
+import os
+import zipfile
+import pytest
+from modules import batch
+from modules.batch import normalize_item, run_batch
+from modules.pipeline import ReportError
+
+ITEMS = [normalize_item({'region': 'Кыргызстан', 'year': 2024, 'months': 'q1', 'report_type': 'both'}),
+         normalize_item({'region': 'Кыргызстан', 'year': 2024, 'months': [2], 'report_type': 'free'})]
+
+def test_batch_archive(caches):
+    temp_dir = caches / 'session'
+    temp_dir.mkdir()
+    result = run_batch(ITEMS, {'use_local_files': True}, str(temp_dir))
+    
+    assert os.listdir(temp_dir) == [os.path.basename(result[0]['path'])]
+    with zipfile.ZipFile(result[0]['path']) as archive:
+        assert len(archive.namelist()) == 3
+
+def test_batch_dir_removed_on_error(caches, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("диск заполнен")
+    
+    monkeypatch.setattr(batch, 'generate_reports', fail)
+    temp_dir = caches / 'session'
+    temp_dir.mkdir()
+    with pytest.raises(ReportError):
+        run_batch(ITEMS, {'use_local_files': True}, str(temp_dir))
+    assert os.listdir(temp_dir) == []
\ No newline at end of file
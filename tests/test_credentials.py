@@ -0,0 +1,54 @@
+import pytest
+from conftest import GOOD_USER
+from modules import xml_cache, report_cache
+from modules.downloader import REGION, CITY, download_batch
+from modules.pipeline import ReportError, create_test_xml_files, load_report_matrix, run_report
+
+# Закрытый месяц: из кэша он берется без обращения к серверу
+YEAR, MONTH = 2020, 1
+
+def _params(username, password):
+    return {'region': REGION, 'city': CITY, 'year': YEAR, 'months': [MONTH], 'report_types': ['free'],
+            'use_local_files': False, 'username': username, 'password': password}
+
+@pytest.fixture
+def warm_cache(caches):
+    """Выгрузка закрытого месяца уже лежит в общем кэше XML"""
+    source_dir = caches / 'source'
+    source_dir.mkdir()
+    file_info = create_test_xml_files(YEAR, [MONTH], str(source_dir))[0]
+    xml_cache.store_file(xml_cache.cache_key(REGION, CITY, YEAR, MONTH), file_info['path'],
+                         report_cache.file_digest(file_info['path']))
+    return caches
+
+def test_download_batch_rejects_wrong_credentials_with_warm_cache(warm_cache, fake_login):
+    tasks = [(REGION, CITY, YEAR, MONTH, str(warm_cache / 'job'))]
+    assert download_batch(tasks, 'user', 'wrong') == {}
+    assert fake_login == ['user']
+    
+    downloaded = download_batch(tasks, *GOOD_USER)
+    assert list(downloaded) == tasks
+
+def test_report_matrix_needs_login_with_warm_cache(warm_cache, fake_login):
+    temp_dir = warm_cache / 'session'
+    temp_dir.mkdir()
+    with pytest.raises(ReportError, match='авторизоваться'):
+        load_report_matrix(_params('user', 'wrong'), str(temp_dir))
+    
+    matrix = load_report_matrix(_params(*GOOD_USER), str(temp_dir))
+    assert len(matrix) == 2
+
+def test_cached_report_needs_login(warm_cache, fake_login):
+    temp_dir = warm_cache / 'session'
+    temp_dir.mkdir()
+    excel_files = run_report(_params(*GOOD_USER), str(temp_dir))
+    assert excel_files
+    
+    with pytest.raises(ReportError, match='авторизоваться'):
+        run_report(_params('user', 'wrong'), str(temp_dir))
+
+def test_known_session_is_reused_without_login(warm_cache, fake_login):
+    tasks = [(REGION, CITY, YEAR, MONTH, str(warm_cache / 'job'))]
+    download_batch(tasks, *GOOD_USER)
+    download_batch(tasks, *GOOD_USER)
+    assert fake_login == ['user']
\ No newline at end of file
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from conftest import GOOD_USER
+from modules import month_store
+from modules.batch import normalize_item, run_batch
+from modules.downloader import REGION, CITY
+from modules.parser import parse_month_file
+from modules.pipeline import ReportError, create_test_xml_files, load_report_matrix
+
+@pytest.fixture
+def stored(caches):
+    """Закрытые месяцы 11.2019-02.2020 в хранилище, записи как после разбора"""
+    source_dir = caches / 'source'
+    source_dir.mkdir()
+    records = {}
+    for year, months in ((2019, [11, 12]), (2020, [1, 2])):
+        for file_info in create_test_xml_files(year, months, str(source_dir)):
+            period = (file_info['year'], file_info['month'])
+            records[period] = parse_month_file(file_info['path'])
+            month_store.save_month(REGION, CITY, *period, f"digest-{period}", records[period], closed=True)
+    return records
+
+def test_records_keep_types(stored):
+    loaded = month_store.load_months(REGION, CITY, list(stored))
+    assert loaded == stored
+    assert all(type(value) is type(expected)
+               for period in stored for record, expected_record in zip(loaded[period], stored[period])
+               for value, expected in zip(record, expected_record))
+
+def test_stored_months_need_login(stored, caches, fake_login):
+    params = {'region': REGION, 'city': CITY, 'year': 2020, 'months': [1, 2], 'report_types': ['free'],
+              'use_local_files': False, 'username': 'user', 'password': 'wrong'}
+    with pytest.raises(ReportError, match='авторизоваться'):
+        load_report_matrix(params, str(caches))
+    
+    matrix = load_report_matrix(dict(params, password=GOOD_USER[1]), str(caches))
+    assert [month['month'] for month in matrix.months] == [1, 2]
+
+def test_stored_months_need_login_in_batch(stored, caches, fake_login):
+    items = [normalize_item({'region': REGION, 'city': CITY, 'year': 2020, 'months': [1]})]
+    params = {'username': 'user', 'password': 'wrong'}
+    with pytest.raises(ReportError, match='авторизоваться'):
+        run_batch(items, params, str(caches))
+
+def test_query_history(stored):
+    matrix = month_store.query_history(REGION, CITY, (2019, 12), (2020, 2))
+    assert [(month['year'], month['month']) for month in matrix.months] == [(2019, 12), (2020, 1), (2020, 2)]
+    assert sorted(matrix.names) == ['1С-Като Экономикс', 'ЛИСТ Кей Джи']
+    assert matrix.values['in_order'].dtype == np.bool_
+    assert matrix.present.all()
+    
+    matrix = month_store.query_history(REGION, CITY, (2019, 1), (2019, 12), partners=['ЛИСТ Кей Джи'])
+    assert matrix.names == ['ЛИСТ Кей Джи']
+    assert matrix.values['paid_amount'].tolist() == [[188, 188]]
+    
+    matrix = month_store.query_history(REGION, CITY, (2019, 1), (2020, 12), partner_city='Ош')
+    assert len(matrix) == 0 and len(matrix.months) == 4
\ No newline at end of file
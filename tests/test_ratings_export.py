@@ -0,0 +1,48 @@
+import json
+import pytest
+from modules.partners import PartnerRegistry, partner_key
+from modules.ratings_export import iter_ratings
+from modules.ratings_matrix import RatingMatrix
+from modules.schema import NUMERIC_FIELDS
+
+MONTHS = [{'key': '2024_01', 'year': 2024, 'month': 1}]
+
+def _record(name, city, paid_amount):
+    values = {field: 0 for field in NUMERIC_FIELDS}
+    values['paid_amount'] = paid_amount
+    return (name, city, *values.values())
+
+def _partner_ids(records, registry):
+    matrix = RatingMatrix.from_month_records(MONTHS, [records], registry=registry)
+    return {(row['name'], row['city']): row['partner_id'] for row in iter_ratings(matrix, ['paid'])}
+
+def test_partner_id_does_not_depend_on_registry_order():
+    records = [_record('Альфа', 'Бишкек', 10), _record('Альфа', 'Ош', 20), _record('Бета', 'Бишкек', 30)]
+    # Другой процесс раньше видел других партнеров и в другом порядке
+    other_registry = PartnerRegistry()
+    other_registry.get_ids(['Гамма', 'Бета'], ['Алматы', 'Бишкек'])
+    
+    ids = _partner_ids(records, PartnerRegistry())
+    assert ids == _partner_ids(list(reversed(records)), other_registry)
+    assert ids[('Альфа', 'Ош')] == partner_key('Альфа', 'Ош')
+    assert len(set(ids.values())) == 3
+
+@pytest.fixture
+def client(caches):
+    from app import app
+    app.config['TESTING'] = True
+    return app.test_client()
+
+@pytest.mark.parametrize('body', [[], [1], 'q1', 5])
+def test_ratings_api_rejects_non_object_body(client, body):
+    response = client.post('/api/ratings', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_ratings_api_stable_partner_id(client):
+    response = client.post('/api/ratings', json={'use_local_files': True, 'year': 2024, 'months': [1, 2],
+                                                 'report_type': 'paid'})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 4
+    assert all(row['partner_id'] == partner_key(row['name'], row['city']) for row in rows)
\ No newline at end of file
@@ -0,0 +1,45 @@
+import gc
+import weakref
+from modules.partners import UNKNOWN_CITY
+from modules.ratings_matrix import RatingMatrix
+from modules.schema import NUMERIC_FIELDS
+
+MONTHS = [{'key': f"2024_{month:02d}", 'year': 2024, 'month': month} for month in (1, 2, 3)]
+
+def _record(name, city, paid_amount):
+    values = {field: 0 for field in NUMERIC_FIELDS}
+    values['paid_amount'] = paid_amount
+    return (name, city, *values.values())
+
+def test_partner_keeps_one_row_across_months():
+    # Порядок партнеров в выгрузках разных месяцев не совпадает
+    month_records = [
+        [_record('Альфа', 'Бишкек', 1), _record('Бета', 'Ош', 2)],
+        [_record('Бета', 'Ош', 20), _record('Гамма', 'Бишкек', 30), _record('Альфа', 'Бишкек', 10)],
+        [_record('Альфа', 'Ош', 500), _record('Альфа', 'Бишкек', 100)]
+    ]
+    matrix = RatingMatrix.from_month_records(MONTHS, month_records)
+    
+    rows = {(name, city): row for row, (name, city) in enumerate(zip(matrix.names, matrix.cities))}
+    assert list(rows) == [('Альфа', 'Бишкек'), ('Бета', 'Ош'), ('Гамма', 'Бишкек'), ('Альфа', 'Ош')]
+    assert matrix.values['paid_amount'][rows[('Альфа', 'Бишкек')]].tolist() == [1, 10, 100]
+    assert matrix.values['paid_amount'][rows[('Бета', 'Ош')]].tolist() == [2, 20, 0]
+    assert matrix.present[rows[('Альфа', 'Ош')]].tolist() == [False, False, True]
+
+def test_missing_city_joins_known_partner():
+    month_records = [[_record('Альфа', 'Бишкек', 1)], [_record('Альфа', UNKNOWN_CITY, 2)],
+                     [_record('Альфа', 'Бишкек', 3)]]
+    matrix = RatingMatrix.from_month_records(MONTHS, month_records)
+    assert matrix.cities == ['Бишкек']
+    assert matrix.values['paid_amount'].tolist() == [[1, 2, 3]]
+
+def test_registry_is_released_with_matrix():
+    first = RatingMatrix.from_month_records(MONTHS[:1], [[_record('Альфа', 'Бишкек', 1)]])
+    second = RatingMatrix.from_month_records(MONTHS[:1], [[_record('Бета', 'Ош', 1)]])
+    assert first.registry is not second.registry
+    assert len(second.registry) == 1
+    
+    registry = weakref.ref(first.registry)
+    del first
+    gc.collect()
+    assert registry() is None
\ No newline at end of file
@@ -0,0 +1,30 @@
+import json
+from conftest import GOOD_USER
+from modules import session_manager
+
+def test_cookies_are_saved_as_json_and_restored(caches, fake_login):
+    session = session_manager.get_session(*GOOD_USER)
+    session.cookies.set('CASTGC', 'ticket', domain='login.1c.ru', path='/')
+    session.cookies.set('JSESSIONID', 'its-session', domain='its.1c.eu', path='/')
+    key = session_manager.credentials_hash(*GOOD_USER)
+    session_manager._save_cookies(key, session)
+    
+    with open(session_manager._cookies_path(key), 'r', encoding='utf-8') as f:
+        assert {cookie['domain'] for cookie in json.load(f)} == {'login.1c.ru', 'its.1c.eu'}
+    
+    # Новый процесс: сессии в памяти нет, она восстанавливается из файла без авторизации
+    session_manager._sessions.clear()
+    restored = session_manager.get_session(*GOOD_USER)
+    assert restored is not session
+    assert fake_login == ['user']
+    assert restored.cookies.get('JSESSIONID', domain='its.1c.eu') == 'its-session'
+    assert restored.cookies.get('CASTGC', domain='login.1c.ru') == 'ticket'
+
+def test_unreadable_cookies_mean_new_login(caches, fake_login):
+    key = session_manager.credentials_hash(*GOOD_USER)
+    caches.joinpath('sessions').mkdir()
+    with open(session_manager._cookies_path(key), 'w', encoding='utf-8') as f:
+        f.write('not json')
+    
+    assert session_manager.get_session(*GOOD_USER)
+    assert fake_login == ['user']
\ No newline at end of file